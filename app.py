@@ -1,11 +1,19 @@
 import streamlit as st
-import boto3
 import os
 import hashlib
-import numpy as np
+import logging
+import random
+import re
 import uuid
 from datetime import datetime
 from dotenv import load_dotenv
+import time
+import aws_clients
+from history_store import build_item, estimate_tokens, extract_sources, format_sources
+from query_router import fallback_suggestions, knowledge_base_config, route
+from prompt_templates import build_input, load_template, token_breakdown
+from hedging import hedged_call, setup_replicas
+from session_memory import SessionGauges, SpillStore, compact, session_size
 
 # Load environment variables
 load_dotenv()
@@ -19,39 +27,45 @@ st.title("🪓 Lucky the Lumberjack Chatbot")
 
 # AWS Setups
 @st.cache_resource
-def setup_bedrock():
-    return boto3.client(
-        'bedrock-agent-runtime',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        aws_session_token=os.getenv('AWS_SESSION_TOKEN'),
-        region_name=os.getenv('AWS_DEFAULT_REGION')
-    )
+def setup_bedrock(region=None):
+    return aws_clients.client('bedrock-agent-runtime', region)
+
+# Instructions are read once per process and sent as the knowledge base prompt template
+@st.cache_resource
+def setup_prompt_template():
+    return load_template("streamlit_answer")
+
+# Older answers of long conversations are spilled here, see session_memory.py
+@st.cache_resource
+def setup_spill_store():
+    return SpillStore(os.getenv("SESSION_SPILL_PATH", ".session_spill.sqlite3"))
+
+@st.cache_resource
+def setup_session_gauges():
+    return SessionGauges()
 
 @st.cache_resource
 def setup_dynamodb():
-    return boto3.resource(
-        'dynamodb',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        aws_session_token=os.getenv('AWS_SESSION_TOKEN'),
-        region_name=os.getenv('AWS_DEFAULT_REGION')
-    )
+    return aws_clients.resource('dynamodb')
+
+MAX_CLARIFICATION_EMBEDDINGS = 50
 
 # Embedding simulation (for real use, call an embedding model)
 def embed(text):
+    import numpy as np
     hash_val = hashlib.sha256(text.encode()).digest()
     return np.frombuffer(hash_val[:128], dtype=np.uint8).astype(np.float32)
 
 # Add embedding to vector store
 def store_embedding(text, metadata):
     vec = embed(text)
-    st.session_state.clarification_embeddings.append((vec, metadata))
+    embeddings = st.session_state.setdefault("clarification_embeddings", [])
+    embeddings.append((vec, metadata))
+    # Keep the most recent ones only, like the chat history budget
+    del embeddings[:-MAX_CLARIFICATION_EMBEDDINGS]
 
 # Function to get dynamic emoji based on message content
 def get_message_emoji(content, role):
-    import random
-    
     if role == "user":
         # Simple user emojis
         user_emojis = ["🤔", "🙋", "❓", "🧐", "💭"]
@@ -78,7 +92,6 @@ def get_message_emoji(content, role):
 
 # Function to get time-based greeting
 def get_greeting():
-    from datetime import datetime
     hour = datetime.now().hour
     if hour < 12:
         return "Good morning 🌲"
@@ -97,45 +110,64 @@ if "session_id" not in st.session_state:
     st.session_state.session_id = str(uuid.uuid4())
 if "suggested_questions" not in st.session_state:
     st.session_state.suggested_questions = []
+if "expanded_refs" not in st.session_state:
+    st.session_state.expanded_refs = set()
 
-bedrock = setup_bedrock()
-dynamodb = setup_dynamodb()
-table = dynamodb.Table('chatbot_history')
 kb_id = os.getenv("KNOWLEDGE_BASE_ID")
 
-def save_to_dynamodb(session_id, query, response, query_type="general"):
+# AWS clients are created when the first question is asked, not on page load
+@st.cache_resource
+def setup_history_table():
+    return setup_dynamodb().Table('chatbot_history')
+
+@st.cache_resource
+def setup_bedrock_replicas():
+    return setup_replicas(setup_bedrock, kb_id)
+
+prompt_template = setup_prompt_template()
+spill_store = setup_spill_store()
+session_gauges = setup_session_gauges()
+
+def save_to_dynamodb(session_id, query, answer, sources=(), query_type="general",
+                     latency_ms=None, input_tokens=None, output_tokens=None, model_tier=None,
+                     prompt_version=None):
     try:
-        table.put_item(
-            Item={
-                'session_id': session_id,
-                'timestamp': datetime.now().isoformat(),
-                'query': query,
-                'response': response,
-                'query_type': query_type
-            }
+        setup_history_table().put_item(
+            Item=build_item(session_id, query, answer, sources, query_type,
+                            latency_ms, input_tokens, output_tokens,
+                            model_tier=model_tier, prompt_version=prompt_version)
         )
     except Exception as e:
         st.error(f"Database save failed: {e}")
 
+# Keep the session within its memory budget: older answers become a summary
+# and their full text moves to the spill store
+compact(st.session_state.messages, st.session_state.session_id, spill_store)
+session_gauges.update(st.session_state.session_id, session_size(st.session_state.messages))
+
+# Operators only: memory of all sessions and the process goes to the server log
+if os.getenv("LOG_MEMORY_GAUGES") == "1":
+    logging.basicConfig(level=logging.INFO)
+    session_gauges.log()
+
 # Display chat history
 for message in st.session_state.messages:
     emoji = get_message_emoji(message["content"], message["role"])
     with st.chat_message(message["role"], avatar=emoji):
-        st.write(message["content"])
-
-chat_history_embeddings = []
+        ref = message.get("ref")
+        if ref and ref in st.session_state.expanded_refs:
+            # Read back from the spill store for this run only, it is not kept in session state
+            st.write(spill_store.get(st.session_state.session_id, ref) or message["content"])
+        else:
+            st.write(message["content"])
+        if ref:
+            expanded = ref in st.session_state.expanded_refs
+            if st.button("Show less" if expanded else "Show full answer", key=f"expand_{ref}"):
+                st.session_state.expanded_refs ^= {ref}
+                st.rerun()
 
-for message in st.session_state.messages[-6:]:  # or more/less
-    content = message["content"]
-    role = message["role"]
-    metadata = {"role": role, "content": content}
-    vec = embed(content)
-    chat_history_embeddings.append((vec, metadata))
-
-chat_memory_snippets = "\n".join([
-    f"{entry[1]['role'].capitalize()}: {entry[1]['content']}"
-    for entry in chat_history_embeddings
-])
+# Last few turns, sent as plain text ahead of each question
+recent_history = st.session_state.messages[-6:]
 
 # Check if we need to process the last message (for button clicks)
 if st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
@@ -158,34 +190,17 @@ if st.session_state.messages and st.session_state.messages[-1]["role"] == "user"
             with st.spinner("🤔 Thinking..."):
                 try:
                     # Call Bedrock Knowledge Base
-                    response = bedrock.retrieve_and_generate(
+                    prompt_text = build_input(last_message, recent_history)
+                    routed = route(last_message)
+                    start = time.perf_counter()
+                    response = hedged_call(setup_bedrock_replicas(), lambda replica: replica.client.retrieve_and_generate(
                         input={
-                            'text': (
-                                f"CHAT HISTORY: {chat_history_embeddings}\n"
-                                "You are a helpful assistant. Be conversational and overly friendly. "
-                                "Always respond in clear, concise sentences. "
-                                "Acknowledge the question, and reiterate the user's question in your response. "
-                                "In your response, break down the steps to solve the user's problem in a structured step by step workflow"
-                                "If the user asks more than one question, please ask the user to prioritize the most important question and to answer that one first"
-                                "If the user asks a question that does not produce a precise result which can be broken down into steps to accomplish, provide a prompt that would provide a more useful result. "
-                                "Never give broad summaries of topics. Instead, route users to specific destinations."
-                                "When you use information from the knowledge base, cite it at the end.\n\n"
-                                "IMPORTANT: At the end of your response, suggest 2-3 specific follow-up questions that are directly related to the topic you just discussed. "
-                                "Format these as natural questions that start with phrases like 'What about...?', 'How do I...?', 'Where can I find...?', 'When is...?', etc. "
-                                "Make sure these questions are specific to the content you just provided, not generic questions.\n\n"
-                                "Suggest alternate contact details if applicable."
-                                f"User question: {last_message}"
-                            )
+                            'text': prompt_text
                         },
-                        retrieveAndGenerateConfiguration={
-                            'type': 'KNOWLEDGE_BASE',
-                            'knowledgeBaseConfiguration': {
-                                'knowledgeBaseId': kb_id,
-                                'modelArn': f'arn:aws:bedrock:us-west-2::foundation-model/{os.getenv("BEDROCK_MODEL_ID")}'
-                            }
-                        }
-                    )
+                        retrieveAndGenerateConfiguration=knowledge_base_config(replica.kb_id, routed, prompt_template["text"], replica.region)
+                    ))
 
+                    latency_ms = (time.perf_counter() - start) * 1000
                     answer = response['output']['text']
                     st.write(answer)
 
@@ -212,35 +227,22 @@ if st.session_state.messages and st.session_state.messages[-1]["role"] == "user"
                         st.markdown("[Visit Cal Poly Humboldt Sponsored Programs Foundation](https://research.humboldt.edu/)")
                         st.markdown("")
                     
-                    # Build sources for storage and display
+                    # Build sources for display; storage keeps them as a separate list
+                    unique_sources = sorted(extract_sources(response))
                     sources_for_storage = "\n\n**📚 Sources:**\n\n"
-                    if 'citations' in response and response['citations']:
-                        unique_sources = set()
-                        for citation in response['citations']:
-                            for ref in citation.get('retrievedReferences', []):
-                                location = ref.get('location', {})
-                                if 'webLocation' in location:
-                                    unique_sources.add(location['webLocation']['url'])
-                                elif 's3Location' in location:
-                                    unique_sources.add(location['s3Location']['uri'])
-                        
-                        if unique_sources:
-                            for source in sorted(unique_sources):
-                                if source.startswith('http'):
-                                    sources_for_storage += f"[{source}]({source})\n\n"
-                                else:
-                                    sources_for_storage += f"{source}\n\n"
-                        else:
-                            sources_for_storage += "[Visit Cal Poly Humboldt Sponsored Programs Foundation](https://research.humboldt.edu/)\n\n"
+                    if unique_sources:
+                        sources_for_storage += format_sources(unique_sources)
                     else:
                         sources_for_storage += "[Visit Cal Poly Humboldt Sponsored Programs Foundation](https://research.humboldt.edu/)\n\n"
-                    
+
                     # Save to DynamoDB
                     full_response = answer + sources_for_storage
-                    save_to_dynamodb(st.session_state.session_id, last_message, full_response, "knowledge_base")
+                    tokens = token_breakdown(prompt_text, prompt_template)
+                    save_to_dynamodb(st.session_state.session_id, last_message, answer, unique_sources, "knowledge_base",
+                                     latency_ms, tokens["input_tokens"], estimate_tokens(answer), routed["tier"],
+                                     tokens["prompt_version"])
                     
                     # Extract suggested questions from the response
-                    import re
                     suggested_questions = []
                     lines = answer.split('\n')
                     
@@ -266,66 +268,10 @@ if st.session_state.messages and st.session_state.messages[-1]["role"] == "user"
                     
                     # If no intelligent questions found, generate topic-specific ones based on knowledge base content
                     if not suggested_questions:
-                        user_question_lower = last_message.lower()
-                        if 'research' in user_question_lower or 'grant' in user_question_lower:
-                            suggested_questions = [
-                                "What is the Sponsored Programs Foundation?",
-                                "How do I contact the research office?",
-                                "What are the indirect cost rates?"
-                            ]
-                        elif 'employment' in user_question_lower or 'job' in user_question_lower or 'faculty' in user_question_lower:
-                            suggested_questions = [
-                                "What are the faculty employment policies?",
-                                "How do I find contact information for HR?",
-                                "What benefits are available to employees?"
-                            ]
-                        elif 'compliance' in user_question_lower or 'audit' in user_question_lower:
-                            suggested_questions = [
-                                "What are the audit requirements?",
-                                "How do I access financial reports?",
-                                "What compliance policies should I know about?"
-                            ]
-                        elif 'forms' in user_question_lower or 'documents' in user_question_lower:
-                            suggested_questions = [
-                                "Where can I find the forms library?",
-                                "What documents are required for proposals?",
-                                "How do I access administrative policies?"
-                            ]
-                        elif 'board' in user_question_lower or 'governance' in user_question_lower:
-                            suggested_questions = [
-                                "Who are the board members?",
-                                "What are the board meeting schedules?",
-                                "How does the foundation governance work?"
-                            ]
-                        else:
-                            suggested_questions = [
-                                "What services does the foundation provide?",
-                                "How can I contact the foundation?",
-                                "What are the foundation's policies?"
-                            ]
-                    
+                        suggested_questions = list(fallback_suggestions(last_message))
+
                     st.session_state.suggested_questions = suggested_questions[:3]  # Limit to 3
                     
-                    # Build sources for storage (avoid duplicates)
-                    sources_for_storage = ""
-                    if 'citations' in response and response['citations']:
-                        unique_sources = set()
-                        for citation in response['citations']:
-                            for ref in citation.get('retrievedReferences', []):
-                                location = ref.get('location', {})
-                                if 'webLocation' in location:
-                                    unique_sources.add(location['webLocation']['url'])
-                                elif 's3Location' in location:
-                                    unique_sources.add(location['s3Location']['uri'])
-                        
-                        if unique_sources:
-                            sources_for_storage = "\n\n**📚 Sources:**\n\n"
-                            for source in sorted(unique_sources):
-                                if source.startswith('http'):
-                                    sources_for_storage += f"[{source}]({source})\n\n"
-                                else:
-                                    sources_for_storage += f"{source}\n\n"
-                    
                     # Add to chat history with sources
                     st.session_state.messages.append({"role": "assistant", "content": full_response})
                     st.rerun()
@@ -333,7 +279,7 @@ if st.session_state.messages and st.session_state.messages[-1]["role"] == "user"
                 except Exception as e:
                     error_msg = f"Error: {e}"
                     st.error(error_msg)
-                    save_to_dynamodb(st.session_state.session_id, last_message, error_msg, "error")
+                    save_to_dynamodb(st.session_state.session_id, last_message, error_msg, query_type="error")
                     st.session_state.messages.append({"role": "assistant", "content": error_msg})
                     st.rerun()
 
@@ -350,34 +296,17 @@ if prompt := st.chat_input("How can I help you today?"):
         with st.spinner("🤔 Thinking..."):
             try:
                 # Call Bedrock Knowledge Base
-                response = bedrock.retrieve_and_generate(
+                prompt_text = build_input(prompt, recent_history)
+                routed = route(prompt)
+                start = time.perf_counter()
+                response = hedged_call(setup_bedrock_replicas(), lambda replica: replica.client.retrieve_and_generate(
                     input={
-                        'text': (
-                            f"CHAT HISTORY: {chat_history_embeddings}\n"
-                            "You are a helpful assistant. Be conversational and overly friendly. "
-                            "Always respond in clear, concise sentences. "
-                            "Acknowledge the question, and reiterate the user's question in your response. "
-                            "In your response, break down the steps to solve the user's problem in a structured step by step workflow"
-                            "If the user asks more than one question, please ask the user to prioritize the most important question and to answer that one first"
-                            "If the user asks a question that does not produce a precise result which can be broken down into steps to accomplish, provide a prompt that would provide a more useful result. "
-                            "Never give broad summaries of topics. Instead, route users to specific destinations."
-                            "When you use information from the knowledge base, cite it at the end.\n\n"
-                            "IMPORTANT: At the end of your response, suggest 2-3 specific follow-up questions that are directly related to the topic you just discussed. "
-                            "Format these as natural questions that start with phrases like 'What about...?', 'How do I...?', 'Where can I find...?', 'When is...?', etc. "
-                            "Make sure these questions are specific to the content you just provided, not generic questions.\n\n"
-                            "Suggest alternate contact details if applicable."
-                            f"User question: {prompt}"
-                        )
+                        'text': prompt_text
                     },
-                    retrieveAndGenerateConfiguration={
-                        'type': 'KNOWLEDGE_BASE',
-                        'knowledgeBaseConfiguration': {
-                            'knowledgeBaseId': kb_id,
-                            'modelArn': f'arn:aws:bedrock:us-west-2::foundation-model/{os.getenv("BEDROCK_MODEL_ID")}'
-                        }
-                    }
-                )
+                    retrieveAndGenerateConfiguration=knowledge_base_config(replica.kb_id, routed, prompt_template["text"], replica.region)
+                ))
 
+                latency_ms = (time.perf_counter() - start) * 1000
                 answer = response['output']['text']
                 st.write(answer)
 
@@ -404,35 +333,22 @@ if prompt := st.chat_input("How can I help you today?"):
                     st.markdown("[Visit Cal Poly Humboldt Sponsored Programs Foundation](https://research.humboldt.edu/)")
                     st.markdown("")
                 
-                # Build sources for storage and display
+                # Build sources for display; storage keeps them as a separate list
+                unique_sources = sorted(extract_sources(response))
                 sources_for_storage = "\n\n**📚 Sources:**\n\n"
-                if 'citations' in response and response['citations']:
-                    unique_sources = set()
-                    for citation in response['citations']:
-                        for ref in citation.get('retrievedReferences', []):
-                            location = ref.get('location', {})
-                            if 'webLocation' in location:
-                                unique_sources.add(location['webLocation']['url'])
-                            elif 's3Location' in location:
-                                unique_sources.add(location['s3Location']['uri'])
-                    
-                    if unique_sources:
-                        for source in sorted(unique_sources):
-                            if source.startswith('http'):
-                                sources_for_storage += f"[{source}]({source})\n\n"
-                            else:
-                                sources_for_storage += f"{source}\n\n"
-                    else:
-                        sources_for_storage += "[Visit Cal Poly Humboldt Sponsored Programs Foundation](https://research.humboldt.edu/)\n\n"
+                if unique_sources:
+                    sources_for_storage += format_sources(unique_sources)
                 else:
                     sources_for_storage += "[Visit Cal Poly Humboldt Sponsored Programs Foundation](https://research.humboldt.edu/)\n\n"
-                
-                # Save to DynamoDB and add to chat history
+
+                # Save to DynamoDB
                 full_response = answer + sources_for_storage
-                save_to_dynamodb(st.session_state.session_id, prompt, full_response, "knowledge_base")
+                tokens = token_breakdown(prompt_text, prompt_template)
+                save_to_dynamodb(st.session_state.session_id, prompt, answer, unique_sources, "knowledge_base",
+                                 latency_ms, tokens["input_tokens"], estimate_tokens(answer), routed["tier"],
+                                 tokens["prompt_version"])
                 
                 # Extract suggested questions from the response
-                import re
                 suggested_questions = []
                 lines = answer.split('\n')
                 
@@ -458,73 +374,17 @@ if prompt := st.chat_input("How can I help you today?"):
                 
                 # If no intelligent questions found, generate topic-specific ones based on knowledge base content
                 if not suggested_questions:
-                    user_question_lower = prompt.lower()
-                    if 'research' in user_question_lower or 'grant' in user_question_lower:
-                        suggested_questions = [
-                            "What is the Sponsored Programs Foundation?",
-                            "How do I contact the research office?",
-                            "What are the indirect cost rates?"
-                        ]
-                    elif 'employment' in user_question_lower or 'job' in user_question_lower or 'faculty' in user_question_lower:
-                        suggested_questions = [
-                            "What are the faculty employment policies?",
-                            "How do I find contact information for HR?",
-                            "What benefits are available to employees?"
-                        ]
-                    elif 'compliance' in user_question_lower or 'audit' in user_question_lower:
-                        suggested_questions = [
-                            "What are the audit requirements?",
-                            "How do I access financial reports?",
-                            "What compliance policies should I know about?"
-                        ]
-                    elif 'forms' in user_question_lower or 'documents' in user_question_lower:
-                        suggested_questions = [
-                            "Where can I find the forms library?",
-                            "What documents are required for proposals?",
-                            "How do I access administrative policies?"
-                        ]
-                    elif 'board' in user_question_lower or 'governance' in user_question_lower:
-                        suggested_questions = [
-                            "Who are the board members?",
-                            "How do I contact board members?",
-                            "What are the board meeting schedules?"
-                        ]
-                    else:
-                        suggested_questions = [
-                            "What services does the foundation provide?",
-                            "How can I contact the foundation?",
-                            "What are the foundation's policies?"
-                        ]
-                
+                    suggested_questions = list(fallback_suggestions(prompt))
+
                 st.session_state.suggested_questions = suggested_questions[:3]  # Limit to 3
                 
-                # Build sources for storage (avoid duplicates)
-                sources_for_storage = ""
-                if 'citations' in response and response['citations']:
-                    unique_sources = set()
-                    for citation in response['citations']:
-                        for ref in citation.get('retrievedReferences', []):
-                            location = ref.get('location', {})
-                            if 'webLocation' in location:
-                                unique_sources.add(location['webLocation']['url'])
-                            elif 's3Location' in location:
-                                unique_sources.add(location['s3Location']['uri'])
-                    
-                    if unique_sources:
-                        sources_for_storage = "\n\n**📚 Sources:**\n\n"
-                        for source in sorted(unique_sources):
-                            if source.startswith('http'):
-                                sources_for_storage += f"[{source}]({source})\n\n"
-                            else:
-                                sources_for_storage += f"{source}\n\n"
-                
                 # Add to chat history with sources
                 st.session_state.messages.append({"role": "assistant", "content": full_response})
   
             except Exception as e:
                 error_msg = f"Error: {e}"
                 st.error(error_msg)
-                save_to_dynamodb(st.session_state.session_id, prompt, error_msg, "error")
+                save_to_dynamodb(st.session_state.session_id, prompt, error_msg, query_type="error")
 
 # Show AI-suggested questions as clickable buttons
 if st.session_state.suggested_questions:
@@ -0,0 +1,26 @@
+import os
+
+# AWS clients for the entry points and CLIs, with credentials and region from
+# the environment (.env). boto3 is imported on first use, it is the slowest
+# import here.
+
+def client(service, region=None, **kwargs):
+    import boto3
+    return boto3.client(
+        service,
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+        aws_session_token=os.getenv('AWS_SESSION_TOKEN'),
+        region_name=region or os.getenv('AWS_DEFAULT_REGION'),
+        **kwargs
+    )
+
+def resource(service, region=None):
+    import boto3
+    return boto3.resource(
+        service,
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+        aws_session_token=os.getenv('AWS_SESSION_TOKEN'),
+        region_name=region or os.getenv('AWS_DEFAULT_REGION')
+    )
@@ -1,69 +1,210 @@
-from flask import Flask, request, render_template, jsonify, session
-import boto3
+from flask import Flask, request, render_template, jsonify, session, url_for
 import os
-import hashlib
-import numpy as np
+import threading
 import uuid
-from datetime import datetime
 from dotenv import load_dotenv
 from flask import Response, stream_with_context
 import time
 import re
 import json
+import aws_clients
+import serving
+from hedging import LatencyTracker, Replica, hedged_stream, setup_replicas
+from query_router import fallback_suggestions, knowledge_base_config, route
+from history_store import build_item, estimate_tokens, extract_sources
+from prompt_templates import build_input, load_template, token_breakdown
+from shadow import ShadowRunner, apply_candidate, candidate_config, shadow_table_name
+from startup import Warmup, warmup_enabled
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "supersecretkey")
+serving.init_app(app)
 
 # AWS Clients
-def setup_bedrock():
-    return boto3.client(
-        'bedrock-agent-runtime',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        aws_session_token=os.getenv('AWS_SESSION_TOKEN'),
-        region_name=os.getenv('AWS_DEFAULT_REGION')
-    )
+def setup_bedrock(region=None):
+    return aws_clients.client('bedrock-agent-runtime', region)
 
 def setup_dynamodb():
-    return boto3.resource(
-        'dynamodb',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        aws_session_token=os.getenv('AWS_SESSION_TOKEN'),
-        region_name=os.getenv('AWS_DEFAULT_REGION')
-    )
+    return aws_clients.resource('dynamodb')
 
-bedrock = setup_bedrock()
-dynamodb = setup_dynamodb()
-table = dynamodb.Table('chatbot_history')
 kb_id = os.getenv("KNOWLEDGE_BASE_ID")
 
-# Embed function
-def embed(text):
-    hash_val = hashlib.sha256(text.encode()).digest()
-    return np.frombuffer(hash_val[:128], dtype=np.uint8).astype(np.float32)
+# Clients are created on first use, or earlier by the warm-up below. Creating
+# them isn't thread-safe (boto3's default session), and the warm-up thread and
+# the first request may both get here, so creation is serialized.
+_clients = {}
+_clients_lock = threading.RLock()
+
+def _client(name, create):
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = create()
+        return _clients[name]
+
+def get_dynamodb():
+    return _client("dynamodb", setup_dynamodb)
+
+def get_table():
+    return _client("table", lambda: get_dynamodb().Table('chatbot_history'))
+
+def get_replicas():
+    return _client("replicas", lambda: setup_replicas(setup_bedrock, kb_id))
+
+first_event_latency = LatencyTracker()
+
+# Instructions are assembled once here and sent as the knowledge base prompt template
+KB_TEMPLATE = load_template("kb_answer")
+
+# Shadow traffic (SHADOW_SAMPLE_RATE > 0): a sample of questions also goes to a
+# candidate configuration in the background, see shadow.py
+shadow_runner = ShadowRunner(
+    lambda item: _client("shadow_table", lambda: get_dynamodb().Table(shadow_table_name())).put_item(Item=item)
+)
+SHADOW_CANDIDATE = candidate_config()
+# Kept apart so candidate timings don't move the live hedging deadline
+shadow_latency = LatencyTracker()
 
 # Save to DynamoDB
-def save_to_dynamodb(session_id, query, response, query_type="general"):
-    table.put_item(
-        Item={
-            'session_id': session_id,
-            'timestamp': datetime.now().isoformat(),
-            'query': query,
-            'response': response,
-            'query_type': query_type
-        }
+def save_to_dynamodb(session_id, query, answer, sources=(), query_type="general",
+                     latency_ms=None, input_tokens=None, output_tokens=None, model_tier=None,
+                     prompt_version=None):
+    get_table().put_item(
+        Item=build_item(session_id, query, answer, sources, query_type,
+                        latency_ms, input_tokens, output_tokens,
+                        model_tier=model_tier, prompt_version=prompt_version)
     )
 
+SUGGESTIONS_RE = re.compile(r'<SUGGESTIONS>(.*?)</SUGGESTIONS>', re.DOTALL)
+
+# Split the model output into the answer and its <SUGGESTIONS> block
+def parse_answer(full_answer, user_input):
+    suggestions = []
+    cleaned_answer = full_answer
+
+    # --- Extract and Clean Suggestions ---
+    suggestion_match = SUGGESTIONS_RE.search(full_answer)
+    if suggestion_match:
+        suggestion_text = suggestion_match.group(1).strip()
+        suggestions = [q.strip() for q in suggestion_text.split('\n') if q.strip()]
+        cleaned_answer = full_answer[:suggestion_match.start()].strip()
+    else:
+        # Fallback logic if the model fails to use the tags
+        suggestions = list(fallback_suggestions(user_input))
+
+    return cleaned_answer, suggestions
+
+SUGGESTIONS_TAG = "<SUGGESTIONS>"
+
+# How much of the streamed text is safe to show: stop at the suggestions block,
+# and hold back a trailing "<SUGG..." that may still turn into the tag
+def visible_length(text):
+    tag = text.find(SUGGESTIONS_TAG)
+    if tag != -1:
+        return tag
+    cut = text.rfind("<")
+    if cut != -1 and SUGGESTIONS_TAG.startswith(text[cut:]):
+        return cut
+    return len(text)
+
+# Stream one question through the knowledge base. Yields ("delta", text) as the
+# model generates, then ("result", dict) with the answer, sources, suggestions,
+# timings and token estimates.
+# With a shadow candidate (shadow.candidate_config) it runs that configuration
+# on the primary region only, without hedging.
+def stream_knowledge_base(user_input, chat_history=(), candidate=None):
+    input_text = build_input(user_input, chat_history)
+    routed = route(user_input)
+    template, targets, tracker, hedge = KB_TEMPLATE, get_replicas(), first_event_latency, None
+    if candidate is not None:
+        routed = apply_candidate(routed, candidate)
+        template = candidate["template"] or KB_TEMPLATE
+        primary = targets[0]
+        targets = [Replica(primary.region, primary.client, candidate["kb_id"] or primary.kb_id)]
+        tracker, hedge = shadow_latency, False
+    start = time.perf_counter()
+    # Primary region first; a hedge or failover region may answer instead
+    stream = hedged_stream(targets, lambda replica: replica.client.retrieve_and_generate_stream(
+        input={
+            'text': input_text
+        },
+        retrieveAndGenerateConfiguration=knowledge_base_config(replica.kb_id, routed, template["text"], replica.region)
+    )['stream'], tracker, hedge)
+    full_answer = ""
+    sent = 0
+    citations = []
+    first_token_ms = None
+    try:
+        for event in stream:
+            if 'output' in event:
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - start) * 1000
+                full_answer += event['output']['text']
+                visible = visible_length(full_answer)
+                if visible > sent:
+                    yield "delta", full_answer[sent:visible]
+                    sent = visible
+            elif 'citation' in event:
+                citation = event['citation']
+                citations.append(citation.get('citation', citation))
+    finally:
+        # Stop reading from Bedrock if the client disconnected mid-answer
+        stream.close()
+
+    # Flush a held-back "<" that never became the tag
+    end = full_answer.find(SUGGESTIONS_TAG)
+    end = len(full_answer) if end == -1 else end
+    if end > sent:
+        yield "delta", full_answer[sent:end]
+
+    cleaned_answer, suggestions = parse_answer(full_answer, user_input)
+    yield "result", {
+        "answer": cleaned_answer,
+        "sources": extract_sources({'citations': citations}),
+        "suggestions": suggestions,
+        "suggestions_parsed": bool(SUGGESTIONS_RE.search(full_answer)),
+        "latency_ms": (time.perf_counter() - start) * 1000,
+        "first_token_ms": first_token_ms,
+        "output_tokens": estimate_tokens(full_answer),
+        "model_tier": routed["tier"],
+        **token_breakdown(input_text, template),
+    }
+
+# Run one question to the end and return only the result (batch.py, shadow candidates)
+def ask_knowledge_base(user_input, chat_history=(), candidate=None):
+    for kind, value in stream_knowledge_base(user_input, chat_history, candidate):
+        if kind == "result":
+            return value
+
+# Do the first-use work in the background so the first chat isn't the slow one;
+# /ready reports when it is done (WARMUP=0 skips it). It starts with the first
+# request (usually the load balancer's /ready probe), not on import, so
+# batch.py and other importers don't run it.
+warmup = Warmup()
+if warmup_enabled():
+    warmup.add("bedrock_clients", get_replicas)
+    # DescribeTable opens the connection pool
+    warmup.add("dynamodb", lambda: get_table().load())
+    warmup.add("templates", lambda: app.jinja_env.get_template("index.html"))
+    warmup.add("assets", lambda: serving.hashed_name(app.static_folder, "title.png"))
+
+@app.before_request
+def start_warmup():
+    warmup.start()
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    status = warmup.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
 @app.route("/", methods=["GET"])
 def index():
     if "session_id" not in session:
         session["session_id"] = str(uuid.uuid4())
     # The initial suggestions for the homepage are now handled by the frontend
-    return render_template("index.html")
+    return render_template("index.html", chat_endpoint=os.getenv("CHAT_ENDPOINT", url_for("chat_stream")))
 
 # This endpoint is no longer needed as the logic is merged into chat_stream
 # @app.route("/suggestions", methods=["POST"])
@@ -88,108 +229,68 @@ def chat_stream():
             payload = {"type": "suggestions", "content": suggestions}
             yield f"data: {json.dumps(payload)}\n\n"
             yield "data: [DONE]\n\n"
-        return Response(stream_with_context(initial_suggestions()), mimetype='text/event-stream')
-
+        return serving.sse_response(stream_with_context(initial_suggestions()), Response)
 
-    # Embed chat history
-    chat_history_embeddings = []
-    for msg in chat_history[-6:]:
-        content = msg.get("content", "")
-        role = msg.get("role", "")
-        metadata = {"role": role, "content": content}
-        vec = embed(content)
-        chat_history_embeddings.append((vec, metadata))
 
-    chat_memory_snippets = "\n".join([
-        f"{entry[1]['role'].capitalize()}: {entry[1]['content']}"
-        for entry in chat_history_embeddings
-    ])
+    # Read before streaming starts; the session isn't available to the shadow thread.
+    # Clients that never loaded "/" (no cookie, or CHAT_ENDPOINT on another origin) get one here
+    session_id = session.setdefault("session_id", str(uuid.uuid4()))
 
     def generate():
+        # The candidate's answer is only used for the comparison
+        shadow_future = shadow_runner.mirror(lambda: ask_knowledge_base(user_input, chat_history, SHADOW_CANDIDATE))
         try:
-            response = bedrock.retrieve_and_generate(
-                input={
-                    'text': (
-                        f"CHAT HISTORY: {chat_history_embeddings}\n\n"
-                        "If the user asks more than one question, please ask the user to prioritize the most important question and to answer that one first"
-                        "If the user asks a question that does not produce a precise result which can be broken down into steps to accomplish, provide 2-3 suggested prompts the user could use that would provide more useful results at the end. "
-                        "Enclose these suggested prompts within <SUGGESTIONS> and </SUGGESTIONS> tags. Do not include any other text in the suggestion block.\n"
-                        "For example: <SUGGESTIONS>What about X?\nHow do I do Y?</SUGGESTIONS>\n\n"
-                        "You are a helpful assistant. Be conversational and friendly. "
-                        "Always respond in clear, concise sentences."
-                        "Your primary goal is to help users quickly find the exact resource, service, or page they need related to research at the university."
-                        "Acknowledge the question, and reiterate the user's question in your response. "
-                        "In your response, break down the steps to solve the user's problem in a structured step by step workflow."
-                        "Never give broad summaries of topics. Instead, route users to specific destinations."
-                        "Suggest alternate contact details if applicable.\n\n"
-                        f"User question: {user_input}"
-                    )
-                },
-                retrieveAndGenerateConfiguration={
-                    'type': 'KNOWLEDGE_BASE',
-                    'knowledgeBaseConfiguration': {
-                        'knowledgeBaseId': kb_id,
-                        'modelArn': f'arn:aws:bedrock:us-west-2::foundation-model/{os.getenv("BEDROCK_MODEL_ID")}'
-                    }
-                }
-            )
-
-            full_answer = response['output']['text']
-            sources = []
-            suggestions = []
-            cleaned_answer = full_answer
-
-            # --- Extract and Clean Suggestions ---
-            suggestion_match = re.search(r'<SUGGESTIONS>(.*?)</SUGGESTIONS>', full_answer, re.DOTALL)
-            if suggestion_match:
-                suggestion_text = suggestion_match.group(1).strip()
-                suggestions = [q.strip() for q in suggestion_text.split('\n') if q.strip()]
-                cleaned_answer = full_answer[:suggestion_match.start()].strip()
-            else:
-                # Fallback logic if the model fails to use the tags
-                if 'research' in user_input.lower() or 'grant' in user_input.lower():
-                    suggestions = ["What is the Sponsored Programs Foundation?", "How do I contact the research office?", "What are the indirect cost rates?"]
+            # --- Yield Payloads to Frontend ---
+            # 1. Answer text as it is generated
+            for kind, value in stream_knowledge_base(user_input, chat_history):
+                if kind == "delta":
+                    payload = {"type": "delta", "content": value}
+                    yield f"data: {json.dumps(payload)}\n\n"
                 else:
-                    suggestions = ["What services does the foundation provide?", "How can I contact the foundation?", "What are the foundation's policies?"]
-
-            # --- Extract Sources ---
-            if 'citations' in response and response['citations']:
-                for citation in response['citations']:
-                    for ref in citation.get('retrievedReferences', []):
-                        location = ref.get('location', {})
-                        if 'webLocation' in location:
-                            sources.append(location['webLocation']['url'])
-                        elif 's3Location' in location:
-                            sources.append(location['s3Location']['uri'])
+                    result = value
+            cleaned_answer = result["answer"]
+            sources = result["sources"]
+            suggestions = result["suggestions"]
 
-            # --- Yield Payloads to Frontend ---
-            # 1. Suggestions
+            # 2. Suggestions
             if suggestions:
                 payload = {"type": "suggestions", "content": suggestions[:3]} # Limit to 3
                 yield f"data: {json.dumps(payload)}\n\n"
 
-            # 2. Cleaned Answer
+            # 3. Final cleaned answer (lets the client reconcile the streamed text)
             payload = {"type": "answer", "content": cleaned_answer}
             yield f"data: {json.dumps(payload)}\n\n"
 
-            # 3. Sources
+            # 4. Sources
             if sources:
                 payload = {"type": "sources", "content": sources}
                 yield f"data: {json.dumps(payload)}\n\n"
 
-            # 4. Signal Completion
+            # 5. Signal Completion
             yield "data: [DONE]\n\n"
 
+            app.logger.info(
+                "%s: %d input tokens (%d query + %d template), %d output tokens",
+                result["prompt_version"], result["input_tokens"], result["query_tokens"],
+                result["template_tokens"], result["output_tokens"]
+            )
+
+            if shadow_future is not None:
+                shadow_runner.record(shadow_future, session_id, user_input, SHADOW_CANDIDATE["name"], result)
+
             # Save to DB after sending response to user
-            db_response = cleaned_answer + (f" [Sources: {' | '.join(sources)}]" if sources else "")
-            save_to_dynamodb(session["session_id"], user_input, db_response, "knowledge_base")
+            save_to_dynamodb(session_id, user_input, cleaned_answer, sources, "knowledge_base",
+                             result["latency_ms"], result["input_tokens"], result["output_tokens"],
+                             result["model_tier"], result["prompt_version"])
 
         except Exception as e:
             payload = {"type": "error", "content": f"Error: {str(e)}"}
             yield f"data: {json.dumps(payload)}\n\n"
             yield "data: [DONE]\n\n"
 
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    # Tell proxies not to buffer, so deltas reach the browser as they are produced
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return serving.sse_response(stream_with_context(generate()), Response, headers=headers)
 
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import backend
+
+# Batch question answering
+# Runs a JSONL file of questions through the same prompt + parsing path as
+# backend.chat_stream and writes one JSONL result per question.
+#
+#   python batch.py questions.jsonl answers.jsonl --workers 4
+#
+# Each input line needs a question ("question", "message" or "body") and may
+# carry an id ("id" or "request_id"); requests.jsonl works as-is. Results
+# already present in the output file are skipped, so an interrupted run
+# resumes where it stopped. On resume the output is compacted to one line per
+# answered id; failed ids are dropped from it and asked again.
+
+QUESTION_KEYS = ("question", "message", "body")
+ID_KEYS = ("id", "request_id")
+
+# Read questions from a JSONL file, skipping blank or malformed lines
+def load_questions(path):
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping line {line_no}: not valid JSON")
+                continue
+            question = next((record[k] for k in QUESTION_KEYS if record.get(k)), None)
+            if not question:
+                print(f"Skipping line {line_no}: no question field")
+                continue
+            question_id = next((str(record[k]) for k in ID_KEYS if record.get(k)), str(line_no))
+            questions.append({"id": question_id, "question": question})
+    return questions
+
+# Ids already answered in a previous run (the output file is the checkpoint).
+# Rewrites the file with only the last successful record per id, so retried
+# questions don't end up in it twice.
+def load_checkpoint(path):
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not record.get("error"):
+                done[record["id"]] = record
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in done.values():
+            f.write(json.dumps(record) + "\n")
+    os.replace(tmp_path, path)
+    return done
+
+# Ask one question, retrying with exponential backoff on failure
+def answer_question(item, retries=3, backoff=1.0):
+    attempt = 0
+    while True:
+        attempt += 1
+        start = time.perf_counter()
+        try:
+            result = backend.ask_knowledge_base(item["question"])
+            return {
+                "id": item["id"],
+                "question": item["question"],
+                "answer": result["answer"],
+                "sources": result["sources"],
+                "suggestions": result["suggestions"][:3],
+                "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+                "first_token_ms": result["first_token_ms"] and round(result["first_token_ms"], 1),
+                "input_tokens": result["input_tokens"],
+                "output_tokens": result["output_tokens"],
+                "model_tier": result["model_tier"],
+                "prompt_version": result["prompt_version"],
+                "attempts": attempt,
+                "error": None,
+            }
+        except Exception as e:
+            if attempt > retries:
+                return {
+                    "id": item["id"],
+                    "question": item["question"],
+                    "answer": None,
+                    "sources": [],
+                    "suggestions": [],
+                    "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+                    "attempts": attempt,
+                    "error": str(e),
+                }
+            time.sleep(backoff * (2 ** (attempt - 1)) + random.uniform(0, backoff))
+
+def run_batch(input_path, output_path, workers=4, retries=3, backoff=1.0, save_history=False):
+    questions = load_questions(input_path)
+    done = load_checkpoint(output_path)
+    pending = [q for q in questions if q["id"] not in done]
+    print(f"{len(questions)} questions, {len(done)} already answered, {len(pending)} to run")
+
+    failed = 0
+    with open(output_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(answer_question, item, retries, backoff) for item in pending]
+        try:
+            for i, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                if record["error"]:
+                    failed += 1
+                elif save_history:
+                    # A failed save must not lose the answer (or abort the remaining questions)
+                    try:
+                        backend.save_to_dynamodb("batch", record["question"], record["answer"], record["sources"],
+                                                 "batch", record["latency_ms"], record["input_tokens"],
+                                                 record["output_tokens"], record["model_tier"], record["prompt_version"])
+                    except Exception as e:
+                        record["history_error"] = str(e)
+                        print(f"Saving {record['id']} to chatbot_history failed: {e}")
+                # Write + flush each result so the file stays a valid checkpoint
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                status = "error" if record["error"] else f"{record['latency_ms']} ms"
+                print(f"[{i}/{len(pending)}] {record['id']}: {status}")
+        except BaseException:
+            # Don't keep asking Bedrock questions whose answers can no longer be written
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    print(f"Done: {len(pending) - failed} answered, {failed} failed")
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions through the knowledge base.")
+    parser.add_argument("input", help="JSONL file of questions")
+    parser.add_argument("output", help="JSONL file to write (and resume) results")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent Bedrock calls")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per question after the first attempt")
+    parser.add_argument("--backoff", type=float, default=1.0, help="Base backoff in seconds between retries")
+    parser.add_argument("--save-history", action="store_true", help="Also store answers in chatbot_history")
+    args = parser.parse_args()
+
+    failed = run_batch(args.input, args.output, args.workers, args.retries, args.backoff, args.save_history)
+    raise SystemExit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,15 @@
 import streamlit as st
-import boto3
 import pandas as pd
 from datetime import datetime
 import os
 import json
 from dotenv import load_dotenv
 from collections import Counter
+import aws_clients
+from history_archive import load_history, open_archive, read_archive, scan_hot
+from history_store import read_item
+from live_feed import DynamoDBStreamSource, IngestionWorker, LiveHistory, ScanSource
+from shadow import shadow_table_name, summarize
 
 #v1
 load_dotenv()
@@ -15,27 +19,16 @@ st.markdown("<h1 style='text-align: center;'>📊 CHAT METRICS</h1>", unsafe_all
 
 @st.cache_resource
 def setup_dynamodb():
-    return boto3.resource(
-        'dynamodb',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        aws_session_token=os.getenv('AWS_SESSION_TOKEN'),
-        region_name=os.getenv('AWS_DEFAULT_REGION')
-    )
+    return aws_clients.resource('dynamodb')
 
+# Only needed for Popular Topics
 @st.cache_resource
 def setup_bedrock():
-    return boto3.client(
-        'bedrock-runtime',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        aws_session_token=os.getenv('AWS_SESSION_TOKEN'),
-        region_name=os.getenv('AWS_DEFAULT_REGION')
-    )
+    return aws_clients.client('bedrock-runtime')
 
 dynamodb = setup_dynamodb()
-bedrock = setup_bedrock()
 table = dynamodb.Table('chatbot_history')
+archive = open_archive()
 
 @st.cache_data(ttl=300)
 def generate_common_questions(queries):
@@ -47,7 +40,7 @@ def generate_common_questions(queries):
         Also, create a question on a next line which best summarizes whe user queries within each category.
         Don't create an example question summary\n\n{all_queries}"""
         
-        response = bedrock.invoke_model(
+        response = setup_bedrock().invoke_model(
             modelId='us.amazon.nova-lite-v1:0',
             body=json.dumps({
                 'messages': [{'role': 'user', 'content': [{'text': prompt}]}],
@@ -60,39 +53,132 @@ def generate_common_questions(queries):
     except Exception as e:
         return f"Error generating questions: {e}"
 
-@st.cache_data(ttl=1)
-def fetch_data():
-    response = table.scan()
-    df = pd.DataFrame(response['Items'])
+# One feed per process: seeded from the hot table and archive once, then kept
+# current from the table's change stream (a shared periodic scan if the table
+# has no stream). Viewers only read its aggregates, see live_feed.py
+@st.cache_resource
+def setup_live_feed():
+    try:
+        source = DynamoDBStreamSource(table)
+    except ValueError:
+        source = ScanSource(table)
+    feed = LiveHistory()
+    feed.load(read_archive(archive), [read_item(item) for item in scan_hot(table)])
+    IngestionWorker(source, feed).start()
+    return feed
+
+live_feed = setup_live_feed()
+
+# Scans the shadow table, so only called while its toggle is on, and at most once a minute
+@st.cache_data(ttl=60)
+def fetch_shadow_summary():
+    try:
+        return summarize(scan_hot(dynamodb.Table(shadow_table_name())))
+    except Exception:
+        # No shadow table yet
+        return []
+
+LIVE_REFRESH_SECONDS = float(os.getenv("LIVE_REFRESH_SECONDS", "2"))
+
+# Every row, hot table and archive, for the panels that need more than the
+# live aggregates; only read when a viewer asks for them
+@st.cache_data(ttl=300, max_entries=1)
+def fetch_history():
+    df = pd.DataFrame(load_history(table, archive))
     if not df.empty:
         df['timestamp'] = pd.to_datetime(df['timestamp'])
         df = df.sort_values('timestamp', ascending=False)
     return df
 
-df = fetch_data()
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def live_metrics():
+    snapshot = live_feed.snapshot()
+    # Announce queries that arrived since this viewer's last refresh
+    seen = st.session_state.setdefault("live_seq", snapshot["seq"])
+    for row in live_feed.changes_since(seen)[-3:]:
+        st.toast(f"New query: {row['query'][:60]}")
+    st.session_state.live_seq = snapshot["seq"]
+    if not snapshot["total_queries"]:
+        st.info("No data found")
+        return
 
-if not df.empty:
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("Total Queries", len(df))
+        st.metric("Total Queries", snapshot["total_queries"])
     with col2:
-        st.metric("Unique Sessions", df['session_id'].nunique())
+        st.metric("Unique Sessions", snapshot["sessions"])
     with col3:
-        avg_queries = len(df) / df['session_id'].nunique()
-        st.metric("Avg Queries/Session", f"{avg_queries:.1f}")
-    
+        st.metric("Avg Queries/Session", f"{snapshot['avg_queries_per_session']:.1f}")
+
     # Query times bar chart
     st.subheader("Query Times")
     _, chart_col, _ = st.columns([1, 2, 1])
     with chart_col:
-        df['hour'] = df['timestamp'].dt.hour
-        hourly_counts = df['hour'].value_counts().reindex(range(24), fill_value=0)
         chart_data = pd.DataFrame({
             'Hour': [f"{h}:00" for h in range(24)],
-            'Number of Queries': hourly_counts.values
+            'Number of Queries': snapshot["hourly"]
         }).set_index('Hour')
         st.bar_chart(chart_data)
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def live_recent_chats():
+    recent_sessions = live_feed.snapshot()["recent_sessions"]
+    if not recent_sessions:
+        return
+    st.subheader("Recent Chats (10)")
+    col1, col2, _ , _ = st.columns([1, 1, 1, 1])
+    with col1:
+        if st.button("Collapse All"):
+            st.session_state.expand_all = False
+            st.rerun(scope="fragment")
+    with col1:
+        if st.button("Expand All"):
+            st.session_state.expand_all = True
+            st.rerun(scope="fragment")
+
+    for session_id, total_queries, rows in recent_sessions:
+        session_start = rows[0]['timestamp'][:16].replace("T", " ")
+        expanded = st.session_state.get('expand_all', False)
+        with st.expander(f"Session {session_id[:8]}... - {session_start} ({total_queries} queries)", expanded=expanded):
+            for row in rows:
+                st.write(f"**{row['timestamp'][11:16]}**")
+                with st.expander(f"Query: {row['query'][:50]}{'...' if len(row['query']) > 50 else ''}"):
+                    st.write(row['query'])
+                with st.expander(f"Response: {row['response'][:50]}{'...' if len(row['response']) > 50 else ''}"):
+                    st.write(row['response'])
+                st.write("---")
+
+# The live panels run even on an empty table, so the first rows show up as they arrive
+live_metrics()
+
+# Live vs candidate configuration on mirrored traffic, see shadow.py
+if st.toggle("Show shadow comparison"):
+    shadow_summary = fetch_shadow_summary()
+    if shadow_summary:
+        st.dataframe(pd.DataFrame(shadow_summary).set_index('candidate').T)
+    else:
+        st.write("No shadow traffic recorded (set SHADOW_SAMPLE_RATE on the Flask server)")
+
+# Token usage and topics need every row, so they only load when switched on
+df = fetch_history() if st.toggle("Show token usage and popular topics (reads the full history)") else pd.DataFrame()
+
+if not df.empty:
     
+    # Prompt token usage per prompt template version
+    if 'input_tokens' in df.columns:
+        with st.expander("Prompt Token Usage"):
+            tokens = df.dropna(subset=['input_tokens']).copy()
+            if 'prompt_version' not in tokens.columns:
+                tokens['prompt_version'] = None
+            # Items logged before prompt templates have no version
+            tokens['prompt_version'] = tokens['prompt_version'].fillna("inline instructions")
+            summary = tokens.groupby('prompt_version').agg(
+                queries=('input_tokens', 'size'),
+                avg_input_tokens=('input_tokens', 'mean'),
+                avg_output_tokens=('output_tokens', 'mean'),
+            ).round(1)
+            st.dataframe(summary)
+
     # Popular Topics
     with st.expander("Popular Topics - Dynamic Analysis"):
         if len(df) > 0:
@@ -143,30 +229,5 @@ if not df.empty:
     #         count = query_counts[selected_query]
     #         st.write(f"**Query:** {selected_query} ({count} times)")
     
-    st.subheader("Recent Chats (10)")
-    col1, col2, _ , _ = st.columns([1, 1, 1, 1])
-    with col1:
-        if st.button("Collapse All"):
-            st.session_state.expand_all = False
-            st.rerun()
-    with col1:
-        if st.button("Expand All"):
-            st.session_state.expand_all = True
-            st.rerun()
-    
-    for session_id in df['session_id'].unique()[:10]:
-        session_data = df[df['session_id'] == session_id]
-        total_queries = len(session_data)
-        display_data = session_data.head(100)
-        session_start = session_data['timestamp'].max().strftime('%Y-%m-%d %H:%M')
-        expanded = st.session_state.get('expand_all', False)
-        with st.expander(f"Session {session_id[:8]}... - {session_start} ({total_queries} queries)", expanded=expanded):
-            for _, row in display_data.iterrows():
-                st.write(f"**{row['timestamp'].strftime('%H:%M')}**")
-                with st.expander(f"Query: {row['query'][:50]}{'...' if len(row['query']) > 50 else ''}"):
-                    st.write(row['query'])
-                with st.expander(f"Response: {row['response'][:50]}{'...' if len(row['response']) > 50 else ''}"):
-                    st.write(row['response'])
-                st.write("---")
-else:
-    st.info("No data found")
\ No newline at end of file
+
+live_recent_chats()
\ No newline at end of file
@@ -0,0 +1,253 @@
+import argparse
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+# Multi-region hedged requests for the Bedrock knowledge base call
+#
+# A replica is a region with its own bedrock-agent-runtime client and
+# knowledge base id. BEDROCK_REGIONS lists them, primary first:
+#
+#   BEDROCK_REGIONS=us-west-2,us-east-1
+#   KNOWLEDGE_BASE_ID_US_EAST_1=...   (defaults to KNOWLEDGE_BASE_ID)
+#
+# hedged_stream() starts the request on the primary. With HEDGING=1, if no
+# event has arrived by the deadline (the primary's p95 time to first event
+# over recent requests, HEDGE_DEADLINE_MS until there are enough samples), it
+# starts the same request on the next replica, and one more replica for each
+# further deadline that passes. Whichever produces an event first wins and the
+# others are closed. A throttling error always fails over to the next replica
+# straight away, hedging enabled or not.
+#
+# hedged_call() (non-streaming calls) only fails over: its one "event" is the
+# whole answer, so a hedge would fire on total generation time, and the losing
+# call could not be cancelled.
+#
+#   python hedging.py simulate    # stub replicas with injected latencies
+
+RETRYABLE_ERRORS = {"ThrottlingException", "ServiceQuotaExceededException", "ServiceUnavailableException"}
+MIN_SAMPLES = 20
+
+class Replica:
+    def __init__(self, region, client, kb_id):
+        self.region = region
+        self.client = client
+        self.kb_id = kb_id
+
+    def __repr__(self):
+        return f"Replica({self.region})"
+
+# Rolling window of the primary's time to first event
+class LatencyTracker:
+    def __init__(self, window=200):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, ms):
+        with self.lock:
+            self.samples.append(ms)
+
+    def p95(self):
+        with self.lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def deadline_ms(self):
+        default = float(os.getenv("HEDGE_DEADLINE_MS", "3000"))
+        if len(self.samples) < MIN_SAMPLES:
+            return default
+        low = float(os.getenv("HEDGE_MIN_DEADLINE_MS", "500"))
+        high = float(os.getenv("HEDGE_MAX_DEADLINE_MS", "10000"))
+        return min(max(self.p95(), low), high)
+
+def hedging_enabled():
+    return os.getenv("HEDGING", "0") == "1"
+
+def is_retryable(error):
+    # botocore ClientError carries the AWS error code in .response
+    code = getattr(error, "response", {}).get("Error", {}).get("Code")
+    return (code or type(error).__name__) in RETRYABLE_ERRORS
+
+# One replica per region in BEDROCK_REGIONS (primary first); make_client(region)
+# returns a bedrock-agent-runtime client for that region
+def setup_replicas(make_client, default_kb_id):
+    default_region = os.getenv("AWS_DEFAULT_REGION") or "us-west-2"
+    regions = [r.strip() for r in os.getenv("BEDROCK_REGIONS", default_region).split(",") if r.strip()]
+    replicas = []
+    for region in regions:
+        kb_id = os.getenv(f"KNOWLEDGE_BASE_ID_{region.upper().replace('-', '_')}") or default_kb_id
+        replicas.append(Replica(region, make_client(region), kb_id))
+    return replicas
+
+def _close(stream):
+    close = getattr(stream, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
+
+# Yield events from whichever replica produces one first. open_stream(replica)
+# must return an iterable of events (a Bedrock EventStream, or a one-item list
+# for non-streaming calls). tracker may be None when hedge is False.
+def hedged_stream(replicas, open_stream, tracker, hedge=None):
+    hedge = (hedging_enabled() if hedge is None else hedge) and tracker is not None
+    events = queue.Queue()
+    streams = {}
+    cancelled = set()
+    start = time.perf_counter()
+
+    def pump(index):
+        try:
+            stream = open_stream(replicas[index])
+            streams[index] = stream
+            if index in cancelled:
+                _close(stream)
+                return
+            for event in stream:
+                if index in cancelled:
+                    break
+                events.put((index, "event", event))
+            events.put((index, "end", None))
+        except Exception as e:
+            events.put((index, "error", e))
+
+    def launch(index):
+        threading.Thread(target=pump, args=(index,), daemon=True).start()
+
+    launch(0)
+    started = 1
+    running = {0}
+    winner = None
+    first = None
+    last_error = None
+    deadline = tracker.deadline_ms() / 1000 if hedge else None
+    # Hedges go out one deadline apart, not all at once
+    next_hedge_at = deadline
+
+    try:
+        # Wait for the first event from any replica, hedging or failing over as needed
+        while winner is None:
+            timeout = None
+            if hedge and started < len(replicas):
+                timeout = max(next_hedge_at - (time.perf_counter() - start), 0)
+            try:
+                index, kind, value = events.get(timeout=timeout)
+            except queue.Empty:
+                launch(started)
+                running.add(started)
+                started += 1
+                next_hedge_at = time.perf_counter() - start + deadline
+                continue
+            if kind == "error":
+                running.discard(index)
+                last_error = value
+                if is_retryable(value) and started < len(replicas) and not running:
+                    launch(started)
+                    running.add(started)
+                    started += 1
+                elif not running:
+                    raise value
+                continue
+            winner, first = index, (kind, value)
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if tracker is None:
+            pass
+        elif winner == 0:
+            tracker.record(elapsed_ms)
+        elif last_error is None and deadline is not None:
+            # A lost race still tells us the primary was at least this slow
+            tracker.record(max(elapsed_ms, deadline * 1000))
+
+        # Cancel the losers
+        for index in running - {winner}:
+            cancelled.add(index)
+            if index in streams:
+                _close(streams[index])
+
+        kind, value = first
+        while kind != "end":
+            if kind == "error":
+                raise value
+            yield value
+            index, kind, value = events.get()
+            while index != winner:
+                index, kind, value = events.get()
+    finally:
+        cancelled.update(range(len(replicas)))
+        for stream in list(streams.values()):
+            _close(stream)
+
+# Non-streaming variant: returns call(replica) from the first replica that
+# isn't throttled. No hedging (see above) and no timing samples: a full answer
+# says nothing about the time to first event.
+def hedged_call(replicas, call):
+    for result in hedged_stream(replicas, lambda replica: [call(replica)], None, hedge=False):
+        return result
+
+# --- Local simulation with stub replicas ---
+
+class StubError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+# Stub stream: sleeps for a sampled time to first event, then yields a few events
+def stub_replica(name, latency_ms, sigma=0.5, throttle_rate=0.0, events=5):
+    def open_stream(replica):
+        if random.random() < throttle_rate:
+            raise StubError("ThrottlingException")
+        time.sleep(random.lognormvariate(0, sigma) * latency_ms / 1000)
+        return [{"output": {"text": f"{name}-{i} "}} for i in range(events)]
+    return Replica(name, open_stream, "stub")
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+def simulate(requests, replicas, hedge):
+    tracker = LatencyTracker()
+    latencies, winners, failures = [], {}, 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        try:
+            first = next(iter(hedged_stream(replicas, lambda r: r.client(r), tracker, hedge)))
+        except Exception:
+            failures += 1
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+        name = first["output"]["text"].split("-")[0]
+        winners[name] = winners.get(name, 0) + 1
+    return {
+        "p50_ms": round(_percentile(latencies, 0.50), 1),
+        "p95_ms": round(_percentile(latencies, 0.95), 1),
+        "p99_ms": round(_percentile(latencies, 0.99), 1),
+        "winners": winners,
+        "failures": failures,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate hedged requests against stub replicas.")
+    parser.add_argument("command", choices=["simulate"])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--primary-ms", type=float, default=300, help="Median primary time to first event")
+    parser.add_argument("--secondary-ms", type=float, default=350, help="Median secondary time to first event")
+    parser.add_argument("--sigma", type=float, default=0.6, help="Log-normal spread of the latencies")
+    parser.add_argument("--throttle", type=float, default=0.02, help="Primary throttling rate")
+    args = parser.parse_args()
+
+    replicas = [
+        stub_replica("primary", args.primary_ms, args.sigma, args.throttle),
+        stub_replica("secondary", args.secondary_ms, args.sigma),
+    ]
+    for hedge in (False, True):
+        print(f"hedging={'on' if hedge else 'off'}: {simulate(args.requests, replicas, hedge)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import argparse
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+import aws_clients
+from history_store import display_response, history_ttl_days, read_item
+
+# Retention for chatbot_history
+#
+# Every item is written with a DynamoDB TTL attribute (expires_at, see
+# history_store.build_item) so the hot table only keeps the last
+# HISTORY_TTL_DAYS days. Before items expire, archive_old_items() rolls them
+# into one gzip-compressed columnar JSON file per day:
+#
+#   <archive>/chatbot_history/2026-10-01.json.gz
+#   {"session_id": [...], "timestamp": [...], "query": [...], ...}
+#
+# The archive lives on local disk (LocalArchiveStore, also the test stand-in)
+# or in any S3-compatible bucket (S3ArchiveStore). load_history() reads the
+# hot table and the archive together, so the dashboard sees the full history.
+#
+#   python history_archive.py archive            # roll items older than ARCHIVE_AFTER_DAYS
+#                                                # (default HISTORY_TTL_DAYS - 7)
+#   python history_archive.py archive --delete   # ...and remove them from the hot table
+#
+# Enable TTL on the table once:
+#   aws dynamodb update-time-to-live --table-name chatbot_history \
+#       --time-to-live-specification Enabled=true,AttributeName=expires_at
+
+COLUMNS = ["session_id", "timestamp", "query", "query_type", "answer", "sources",
+           "latency_ms", "input_tokens", "output_tokens", "model_tier",
+           "prompt_version"]
+PARTITION_PREFIX = "chatbot_history/"
+PARTITION_SUFFIX = ".json.gz"
+
+# Archive a week before the TTL removes items unless ARCHIVE_AFTER_DAYS says otherwise
+def archive_after_days():
+    default = max(history_ttl_days() - 7, 1)
+    return int(os.getenv("ARCHIVE_AFTER_DAYS", str(default)))
+
+class LocalArchiveStore:
+    def __init__(self, root):
+        self.root = root
+
+    def list(self, prefix):
+        folder = os.path.join(self.root, prefix)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(prefix + name for name in os.listdir(folder))
+
+    def get(self, key):
+        path = os.path.join(self.root, key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def put(self, key, data):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file first so readers never see a half-written partition
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+class S3ArchiveStore:
+    def __init__(self, client, bucket, prefix=""):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+
+    def list(self, prefix):
+        keys = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            keys.extend(obj["Key"][len(self.prefix):] for obj in page.get("Contents", []))
+        return sorted(keys)
+
+    def get(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+# Pick the archive store from HISTORY_ARCHIVE_URI ("s3://bucket/prefix" or a local folder)
+def open_archive(uri=None):
+    uri = uri or os.getenv("HISTORY_ARCHIVE_URI", "archive")
+    if uri.startswith("s3://"):
+        bucket, _, prefix = uri[len("s3://"):].partition("/")
+        client = aws_clients.client('s3', endpoint_url=os.getenv('ARCHIVE_S3_ENDPOINT') or None)
+        return S3ArchiveStore(client, bucket, prefix)
+    return LocalArchiveStore(uri)
+
+def _plain(value):
+    # DynamoDB hands back Decimals, which json cannot encode
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple, set)):
+        return [_plain(v) for v in value]
+    return float(value)
+
+def encode_partition(rows):
+    columns = {col: [_plain(row.get(col)) for row in rows] for col in COLUMNS}
+    return gzip.compress(json.dumps(columns).encode("utf-8"))
+
+def decode_partition(data):
+    columns = json.loads(gzip.decompress(data).decode("utf-8"))
+    count = len(columns.get("timestamp", []))
+    rows = [{col: columns[col][i] for col in columns} for i in range(count)]
+    for row in rows:
+        row['sources'] = row.get('sources') or []
+        row['response'] = display_response(row.get('answer') or "", row['sources'])
+    return rows
+
+def _partition_key(day):
+    return f"{PARTITION_PREFIX}{day}{PARTITION_SUFFIX}"
+
+# Rows from archived day partitions, optionally only days on or after `since` (YYYY-MM-DD)
+def read_archive(store, since=None):
+    rows = []
+    for key in store.list(PARTITION_PREFIX):
+        if not key.endswith(PARTITION_SUFFIX):
+            continue
+        day = key[len(PARTITION_PREFIX):-len(PARTITION_SUFFIX)]
+        if since and day < since:
+            continue
+        data = store.get(key)
+        if data:
+            rows.extend(decode_partition(data))
+    return rows
+
+def scan_hot(table, **scan_kwargs):
+    items = []
+    while True:
+        page = table.scan(**scan_kwargs)
+        items.extend(page['Items'])
+        if 'LastEvaluatedKey' not in page:
+            return items
+        scan_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+# Combine archived rows with raw hot items, deduplicated (the hot copy wins)
+def merge_history(archived_rows, hot_items):
+    rows = {(row['session_id'], row['timestamp']): row for row in archived_rows}
+    for item in hot_items:
+        row = read_item(item)
+        rows[(row['session_id'], row['timestamp'])] = row
+    return list(rows.values())
+
+# Hot table + archive in one list of read_item-style rows
+def load_history(table, store=None, since=None):
+    archived = read_archive(store, since) if store is not None else []
+    return merge_history(archived, scan_hot(table))
+
+# Roll hot items older than `older_than_days` into day partitions; returns the number archived
+def archive_old_items(table, store, older_than_days=None, delete=False):
+    from boto3.dynamodb.conditions import Attr
+
+    days = archive_after_days() if older_than_days is None else older_than_days
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+    items = scan_hot(table, FilterExpression=Attr('timestamp').lt(cutoff))
+
+    by_day = {}
+    for item in items:
+        row = read_item(item)
+        by_day.setdefault(row['timestamp'][:10], []).append(row)
+
+    for day, rows in by_day.items():
+        key = _partition_key(day)
+        existing = store.get(key)
+        merged = {(r['session_id'], r['timestamp']): r for r in (decode_partition(existing) if existing else [])}
+        merged.update({(r['session_id'], r['timestamp']): r for r in rows})
+        store.put(key, encode_partition(sorted(merged.values(), key=lambda r: r['timestamp'])))
+
+    # Only delete once every partition is written
+    if delete:
+        with table.batch_writer() as batch:
+            for item in items:
+                batch.delete_item(Key={'session_id': item['session_id'], 'timestamp': item['timestamp']})
+    return len(items)
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old chatbot_history items.")
+    parser.add_argument("command", choices=["archive"])
+    parser.add_argument("--days", type=int, default=None, help="Archive items older than this many days")
+    parser.add_argument("--archive", default=None, help="Archive location (folder or s3://bucket/prefix)")
+    parser.add_argument("--delete", action="store_true", help="Delete archived items from the hot table")
+    args = parser.parse_args()
+
+    dynamodb = aws_clients.resource('dynamodb')
+    count = archive_old_items(dynamodb.Table('chatbot_history'), open_archive(args.archive), args.days, args.delete)
+    print(f"Archived {count} items")
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    main()
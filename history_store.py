@@ -0,0 +1,174 @@
+import os
+import re
+import sys
+import zlib
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import aws_clients
+
+# chatbot_history item schema
+#
+# v1 (no schema_version): 'response' holds the answer with the sources pasted
+#     in, either as a markdown "**📚 Sources:**" block (app.py) or as a
+#     trailing "[Sources: a | b]" (backend.py).
+# v2: the answer and its sources are stored separately.
+#     'answer'      plain answer text, or
+#     'answer_z'    zlib-compressed answer (binary) when longer than
+#                   COMPRESS_THRESHOLD bytes
+#     'sources'     deduplicated list of source URLs / S3 URIs
+#     'latency_ms', 'input_tokens', 'output_tokens'  numbers
+#     'model_tier'  query_router tier that answered ("simple" / "complex")
+#     'prompt_version'  prompt template used, e.g. "kb_answer/v1"
+#     'expires_at'  DynamoDB TTL (epoch seconds), see history_archive.py
+#
+# Use build_item() to write and read_item() to read; read_item() accepts
+# both versions, so old rows keep working without a migration.
+
+SCHEMA_VERSION = 2
+COMPRESS_THRESHOLD = 1024
+TTL_ATTRIBUTE = "expires_at"
+
+MARKDOWN_SOURCES = "\n\n**📚 Sources:**\n\n"
+INLINE_SOURCES = re.compile(r"\s*\[Sources: (.*)\]\s*$", re.DOTALL)
+MARKDOWN_LINK = re.compile(r"\[[^\]]*\]\(([^)]+)\)")
+# app.py showed this link when an answer had no citations; it is not a source
+PLACEHOLDER_SOURCE = "https://research.humboldt.edu/"
+
+# Rough token count (~4 characters per token) for accounting when the API does not report usage
+def estimate_tokens(text):
+    return (len(text) + 3) // 4 if text else 0
+
+# Days an item stays in the hot table before DynamoDB expires it
+def history_ttl_days():
+    return int(os.getenv("HISTORY_TTL_DAYS", "90"))
+
+# Drop duplicate sources but keep their first-seen order
+def dedupe_sources(sources):
+    return list(dict.fromkeys(s for s in sources if s))
+
+# Unique source links from a knowledge base response (or {'citations': [...]} from a stream)
+def extract_sources(response):
+    sources = []
+    for citation in response.get('citations') or []:
+        for ref in citation.get('retrievedReferences', []):
+            location = ref.get('location', {})
+            if 'webLocation' in location:
+                sources.append(location['webLocation']['url'])
+            elif 's3Location' in location:
+                sources.append(location['s3Location']['uri'])
+    return dedupe_sources(sources)
+
+def build_item(session_id, query, answer, sources=(), query_type="general",
+               latency_ms=None, input_tokens=None, output_tokens=None, timestamp=None,
+               model_tier=None, prompt_version=None):
+    timestamp = timestamp or datetime.now().isoformat()
+    item = {
+        'session_id': session_id,
+        'timestamp': timestamp,
+        'schema_version': SCHEMA_VERSION,
+        'query': query,
+        'query_type': query_type,
+        'sources': dedupe_sources(sources),
+        TTL_ATTRIBUTE: int((datetime.fromisoformat(timestamp) + timedelta(days=history_ttl_days())).timestamp()),
+    }
+    encoded = answer.encode("utf-8")
+    if len(encoded) > COMPRESS_THRESHOLD:
+        item['answer_z'] = zlib.compress(encoded, 6)
+    else:
+        item['answer'] = answer
+    # DynamoDB numbers must be int or Decimal, never float
+    if latency_ms is not None:
+        item['latency_ms'] = Decimal(str(round(latency_ms, 1)))
+    if input_tokens is not None:
+        item['input_tokens'] = int(input_tokens)
+    if output_tokens is not None:
+        item['output_tokens'] = int(output_tokens)
+    if model_tier:
+        item['model_tier'] = model_tier
+    if prompt_version:
+        item['prompt_version'] = prompt_version
+    return item
+
+# Split a v1 'response' string back into answer + sources
+def split_legacy_response(response):
+    if MARKDOWN_SOURCES in response:
+        answer, block = response.split(MARKDOWN_SOURCES, 1)
+        sources = []
+        for line in block.split("\n"):
+            line = line.strip()
+            if not line:
+                continue
+            link = MARKDOWN_LINK.fullmatch(line)
+            sources.append(link.group(1) if link else line)
+        return answer, dedupe_sources(s for s in sources if s != PLACEHOLDER_SOURCE)
+    match = INLINE_SOURCES.search(response)
+    if match:
+        return response[:match.start()], dedupe_sources(s.strip() for s in match.group(1).split(" | "))
+    return response, []
+
+def format_sources(sources):
+    return "".join(f"[{s}]({s})\n\n" if s.startswith("http") else f"{s}\n\n" for s in sources)
+
+# Answer followed by the markdown sources block, as shown in the UI and dashboard
+def display_response(answer, sources):
+    return answer + (MARKDOWN_SOURCES + format_sources(sources) if sources else "")
+
+# Normalize a v1 or v2 item; always returns 'answer', 'sources' and the display 'response'
+def read_item(item):
+    item = dict(item)
+    if item.get('schema_version'):
+        if 'answer_z' in item:
+            raw = item.pop('answer_z')
+            # boto3 returns Binary wrappers; plain bytes come from local stand-ins
+            item['answer'] = zlib.decompress(bytes(getattr(raw, 'value', raw))).decode("utf-8")
+        item.setdefault('answer', "")
+        item['sources'] = list(item.get('sources') or [])
+        item.pop(TTL_ATTRIBUTE, None)
+        for key in ('latency_ms', 'input_tokens', 'output_tokens'):
+            if key in item:
+                item[key] = float(item[key])
+    else:
+        item['answer'], item['sources'] = split_legacy_response(item.get('response', ""))
+        item['schema_version'] = 1
+    item['response'] = display_response(item['answer'], item['sources'])
+    return item
+
+# Rewrite v1 items in place as v2 items; returns the number migrated
+def migrate_table(table):
+    from history_archive import archive_after_days
+
+    # build_item() expires items TTL days after their timestamp, which is already
+    # past for old rows; DynamoDB would delete them before they are archived.
+    # Give every migrated item at least the archive window from now.
+    window = timedelta(days=max(history_ttl_days() - archive_after_days(), 1))
+    earliest_expiry = int((datetime.now() + window).timestamp())
+    migrated = 0
+    scan_kwargs = {}
+    with table.batch_writer() as batch:
+        while True:
+            page = table.scan(**scan_kwargs)
+            for item in page['Items']:
+                if item.get('schema_version'):
+                    continue
+                answer, sources = split_legacy_response(item.get('response', ""))
+                new_item = build_item(
+                    item['session_id'], item.get('query', ""), answer, sources,
+                    item.get('query_type', "general"), timestamp=item['timestamp'],
+                )
+                new_item[TTL_ATTRIBUTE] = max(new_item[TTL_ATTRIBUTE], earliest_expiry)
+                batch.put_item(Item=new_item)
+                migrated += 1
+            if 'LastEvaluatedKey' not in page:
+                break
+            scan_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+    return migrated
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["migrate"]:
+        print("usage: python history_store.py migrate")
+        raise SystemExit(2)
+    from dotenv import load_dotenv
+    load_dotenv()
+    dynamodb = aws_clients.resource('dynamodb')
+    print(f"Migrated {migrate_table(dynamodb.Table('chatbot_history'))} items")
@@ -0,0 +1,321 @@
+import argparse
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+
+import aws_clients
+from history_store import build_item, read_item
+
+# Live dashboard feed from the chatbot_history change stream
+#
+# One IngestionWorker per dashboard process reads new and changed items and
+# applies them to a LiveHistory: running totals, queries per hour, and the
+# most recent sessions with their latest queries. Dashboard viewers only read
+# that in-memory state, so the DynamoDB read cost stays the same however many
+# tabs are open.
+#
+# Sources (read() returns {"event", "key", "item"} records, item normalized by read_item()):
+#   DynamoDBStreamSource  DynamoDB Streams on the table (enable with
+#                         StreamViewType NEW_IMAGE or NEW_AND_OLD_IMAGES)
+#   ScanSource            fallback when the table has no stream: one shared
+#                         scan every LIVE_SCAN_SECONDS while someone is viewing
+#   LocalStreamSource     in-memory stand-in with table.put_item()
+#
+#   python live_feed.py demo    # worker + aggregates against LocalStreamSource
+
+logger = logging.getLogger(__name__)
+
+# get_records errors that mean the shard iterator is dead (expired after 15
+# minutes unused, or pointing at records the stream has trimmed)
+DEAD_ITERATOR_ERRORS = {"ExpiredIteratorException", "TrimmedDataAccessException"}
+
+def key_of(row):
+    return (row['session_id'], row['timestamp'])
+
+# DynamoDB stream record -> {"event", "key", "item"} with the item normalized by read_item()
+def stream_record(record, deserializer):
+    keys = {k: deserializer.deserialize(v) for k, v in record['dynamodb']['Keys'].items()}
+    image = record['dynamodb'].get('NewImage')
+    item = {k: deserializer.deserialize(v) for k, v in image.items()} if image else None
+    return {"event": record['eventName'], "key": key_of(keys), "item": read_item(item) if item else None}
+
+class DynamoDBStreamSource:
+    DISCOVER_SECONDS = 60
+
+    def __init__(self, table, client=None):
+        from boto3.dynamodb.types import TypeDeserializer
+
+        self.stream_arn = table.latest_stream_arn
+        if not self.stream_arn:
+            raise ValueError(f"Table {table.name} has no stream enabled")
+        self.client = client or aws_clients.client('dynamodbstreams')
+        self.deserializer = TypeDeserializer()
+        self.iterators = {}
+        self.finished = set()
+        self.discovered_at = 0
+
+    # Pick up new shards; records in shards opened before we started are replayed
+    # from the start, which is harmless because applying an item twice is a no-op
+    def discover(self):
+        kwargs = {'StreamArn': self.stream_arn}
+        while True:
+            description = self.client.describe_stream(**kwargs)['StreamDescription']
+            for shard in description['Shards']:
+                shard_id = shard['ShardId']
+                if shard_id in self.iterators or shard_id in self.finished:
+                    continue
+                self.iterators[shard_id] = self.client.get_shard_iterator(
+                    StreamArn=self.stream_arn, ShardId=shard_id, ShardIteratorType='TRIM_HORIZON'
+                )['ShardIterator']
+            if 'LastEvaluatedShardId' not in description:
+                break
+            kwargs['ExclusiveStartShardId'] = description['LastEvaluatedShardId']
+        self.discovered_at = time.time()
+
+    def read(self):
+        if not self.iterators or time.time() - self.discovered_at > self.DISCOVER_SECONDS:
+            self.discover()
+        records = []
+        for shard_id, iterator in list(self.iterators.items()):
+            try:
+                page = self.client.get_records(ShardIterator=iterator, Limit=1000)
+            except Exception as e:
+                if getattr(e, "response", {}).get("Error", {}).get("Code") not in DEAD_ITERATOR_ERRORS:
+                    raise
+                # Get a fresh iterator on the next discover; replayed records are no-ops
+                logger.warning("Shard %s iterator is no longer valid, rediscovering: %s", shard_id, e)
+                del self.iterators[shard_id]
+                self.discovered_at = 0
+                continue
+            records.extend(stream_record(r, self.deserializer) for r in page['Records'])
+            if page.get('NextShardIterator'):
+                self.iterators[shard_id] = page['NextShardIterator']
+            else:
+                # Shard closed (it split or rotated); its children show up on the next discover
+                del self.iterators[shard_id]
+                self.finished.add(shard_id)
+                self.discovered_at = 0
+        return records
+
+class ScanSource:
+    # Each read is a full table scan, so the worker only calls it while the dashboard has viewers
+    on_demand = True
+
+    def __init__(self, table, interval=None):
+        self.table = table
+        self.interval = interval or float(os.getenv("LIVE_SCAN_SECONDS", "30"))
+        self.scanned_at = 0
+
+    def read(self):
+        from history_archive import scan_hot
+
+        if time.time() - self.scanned_at < self.interval:
+            return []
+        self.scanned_at = time.time()
+        return [{"event": "INSERT", "key": key_of(item), "item": read_item(item)} for item in scan_hot(self.table)]
+
+class LocalStreamSource:
+    def __init__(self):
+        self.records = queue.Queue()
+        self.items = {}
+
+    # Same call as table.put_item, so it can stand in for the table in tests
+    def put_item(self, Item):
+        key = key_of(Item)
+        event = "MODIFY" if key in self.items else "INSERT"
+        self.items[key] = Item
+        self.records.put({"event": event, "key": key, "item": read_item(Item)})
+
+    def delete_item(self, Key):
+        self.items.pop(key_of(Key), None)
+        self.records.put({"event": "REMOVE", "key": key_of(Key), "item": None})
+
+    def read(self):
+        records = []
+        while True:
+            try:
+                records.append(self.records.get_nowait())
+            except queue.Empty:
+                return records
+
+# In-memory aggregates and recent-session buffers, shared by all viewers.
+# Full rows are only kept in the recent-session buffers; panels that need the
+# whole history (dashboard.fetch_history) read it themselves.
+class LiveHistory:
+    def __init__(self, recent_sessions=10, recent_queries=100, max_deltas=500):
+        self.recent_sessions = recent_sessions
+        self.recent_queries = recent_queries
+        self.cond = threading.Condition()
+        # Keys of the hot table's items, so a stream replay or a rescan of an
+        # item is not counted twice; dropped when the item is removed
+        self.known = set()
+        self.queries_per_session = Counter()
+        self.hourly = [0] * 24
+        self.recent = OrderedDict()
+        self.deltas = deque(maxlen=max_deltas)
+        self.seq = 0
+        self.viewed_at = 0
+
+    # Returns "new", "changed" (a row shown in a recent-session buffer was
+    # rewritten), or None if nothing visible changed (stream replays, rescans)
+    def _upsert(self, row):
+        key = key_of(row)
+        if key not in self.known:
+            self.known.add(key)
+            self._add(row)
+            return "new"
+        for i, held in enumerate(self.recent.get(row['session_id'], ())):
+            if key_of(held) == key:
+                if held == row:
+                    return None
+                self.recent[row['session_id']][i] = row
+                return "changed"
+        return None
+
+    # Count a row that hasn't been counted before
+    def _add(self, row):
+        buffer = self.recent.get(row['session_id'])
+        self.queries_per_session[row['session_id']] += 1
+        self.hourly[int(row['timestamp'][11:13])] += 1
+        if buffer is None:
+            buffer = self.recent[row['session_id']] = deque(maxlen=self.recent_queries)
+        buffer.append(row)
+        self.recent.move_to_end(row['session_id'])
+        while len(self.recent) > self.recent_sessions:
+            self.recent.popitem(last=False)
+
+    # Seed from the archive and the hot table (read_item() rows) once, before the
+    # worker starts. Archived rows only feed the aggregates; the hot copy wins.
+    def load(self, archived_rows, hot_rows):
+        with self.cond:
+            hot_keys = {key_of(row) for row in hot_rows}
+            rows = [row for row in archived_rows if key_of(row) not in hot_keys] + list(hot_rows)
+            for row in sorted(rows, key=lambda r: r['timestamp']):
+                if key_of(row) in hot_keys:
+                    self._upsert(row)
+                else:
+                    self._add(row)
+            self.seq += 1
+            self.cond.notify_all()
+
+    def apply(self, records):
+        with self.cond:
+            changed = False
+            for record in records:
+                # Deletes come from TTL expiry or `history_archive.py archive --delete`;
+                # either way the item now lives in the archive, so keep counting it
+                if record["event"] == "REMOVE" or record["item"] is None:
+                    self.known.discard(record.get("key"))
+                    continue
+                result = self._upsert(record["item"])
+                if result is None:
+                    continue
+                self.seq += 1
+                if result == "new":
+                    self.deltas.append((self.seq, record["item"]))
+                changed = True
+            if changed:
+                self.cond.notify_all()
+
+    # Block until something changed after `seq` (or the timeout); returns the current seq
+    def wait(self, seq, timeout=None):
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != seq, timeout)
+            return self.seq
+
+    # New rows after `seq`, oldest first (only the last max_deltas are kept)
+    def changes_since(self, seq):
+        with self.cond:
+            return [row for s, row in self.deltas if s > seq]
+
+    # True if a viewer has read the feed in the last `seconds`
+    def viewed_within(self, seconds):
+        with self.cond:
+            return time.time() - self.viewed_at < seconds
+
+    def snapshot(self):
+        with self.cond:
+            self.viewed_at = time.time()
+            sessions = len(self.queries_per_session)
+            total = sum(self.queries_per_session.values())
+            return {
+                "seq": self.seq,
+                "total_queries": total,
+                "sessions": sessions,
+                "avg_queries_per_session": total / sessions if sessions else 0.0,
+                "hourly": list(self.hourly),
+                # Most recently active first, each with its newest queries first
+                "recent_sessions": [
+                    (session_id, self.queries_per_session[session_id], list(reversed(buffer)))
+                    for session_id, buffer in reversed(self.recent.items())
+                ],
+            }
+
+class IngestionWorker(threading.Thread):
+    # On-demand sources (ScanSource) pause once no viewer has asked for this long
+    VIEWER_SECONDS = 60
+
+    def __init__(self, source, history, poll_seconds=None):
+        super().__init__(daemon=True, name="live-feed")
+        self.source = source
+        self.history = history
+        self.poll_seconds = poll_seconds or float(os.getenv("LIVE_POLL_SECONDS", "1"))
+        self.stopped = threading.Event()
+
+    def run(self):
+        backoff = self.poll_seconds
+        while not self.stopped.is_set():
+            if getattr(self.source, "on_demand", False) and not self.history.viewed_within(self.VIEWER_SECONDS):
+                self.stopped.wait(self.poll_seconds)
+                continue
+            try:
+                records = self.source.read()
+                backoff = self.poll_seconds
+            except Exception:
+                logger.exception("Live feed read failed")
+                backoff = min(backoff * 2, 60)
+                self.stopped.wait(backoff)
+                continue
+            if records:
+                self.history.apply(records)
+            else:
+                self.stopped.wait(self.poll_seconds)
+
+    def stop(self):
+        self.stopped.set()
+
+# --- Local demo against the in-memory stand-in ---
+
+def demo(queries, sessions):
+    source = LocalStreamSource()
+    history = LiveHistory()
+    worker = IngestionWorker(source, history, poll_seconds=0.05)
+    worker.start()
+    session_ids = [str(uuid.uuid4()) for _ in range(sessions)]
+    seq = history.seq
+    for i in range(queries):
+        source.put_item(Item=build_item(random.choice(session_ids), f"Question {i}?", f"Answer {i}.",
+                                        latency_ms=random.uniform(300, 3000)))
+        seq = history.wait(seq, timeout=1)
+    worker.stop()
+    snapshot = history.snapshot()
+    print(f"{snapshot['total_queries']} queries in {snapshot['sessions']} sessions, seq {snapshot['seq']}")
+    for session_id, count, rows in snapshot["recent_sessions"][:3]:
+        print(f"  {session_id[:8]}: {count} queries, latest {rows[0]['query']!r}")
+    print(f"{len(history.changes_since(0))} deltas buffered")
+
+def main():
+    parser = argparse.ArgumentParser(description="Live dashboard feed.")
+    parser.add_argument("command", choices=["demo"])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=5)
+    args = parser.parse_args()
+    demo(args.queries, args.sessions)
+
+if __name__ == "__main__":
+    main()
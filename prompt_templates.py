@@ -0,0 +1,68 @@
+import os
+import re
+
+from history_store import estimate_tokens
+
+# Versioned prompt templates
+#
+# The fixed instructions live in prompts/<name>/v<N>.txt and are sent through
+# the knowledge base generationConfiguration.promptTemplate instead of being
+# pasted into input.text every turn. input.text then only carries the recent
+# chat history and the question (it is also what the knowledge base searches
+# with, so keeping it short helps retrieval too).
+#
+# Bedrock still puts the whole template into the model prompt on every call,
+# and its tokens are billed as input every time: RetrieveAndGenerate has no
+# cache point, so nothing is cached. The input saved compared with the old
+# inline prompt comes from dropping the Python repr of the history embedding
+# vectors and sending the question once instead of twice.
+#
+# Bedrock fills these placeholders in a template:
+#   $search_results$              retrieved passages (required)
+#   $output_format_instructions$  citation format (needed for sources)
+#   $query$                       input.text
+#
+# The newest version is used unless PROMPT_<NAME>_VERSION pins one, e.g.
+# PROMPT_KB_ANSWER_VERSION=1.
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+REQUIRED_PLACEHOLDERS = ("$search_results$", "$output_format_instructions$", "$query$")
+VERSION_FILE = re.compile(r"^v(\d+)\.txt$")
+
+def versions(name):
+    folder = os.path.join(PROMPTS_DIR, name)
+    found = [int(m.group(1)) for m in map(VERSION_FILE.match, os.listdir(folder)) if m]
+    return sorted(found)
+
+def load_template(name, version=None):
+    version = version or os.getenv(f"PROMPT_{name.upper()}_VERSION")
+    version = int(version) if version else versions(name)[-1]
+    with open(os.path.join(PROMPTS_DIR, name, f"v{version}.txt"), encoding="utf-8") as f:
+        text = f.read().strip()
+    missing = [p for p in REQUIRED_PLACEHOLDERS if p not in text]
+    if missing:
+        raise ValueError(f"Prompt template {name} v{version} is missing {', '.join(missing)}")
+    return {"name": name, "version": version, "text": text, "tokens": estimate_tokens(text)}
+
+# input.text for one turn: the last few chat turns as plain text, then the question
+def build_input(question, chat_history=(), turns=6):
+    history = list(chat_history)
+    # Clients usually include the current question as the last turn already
+    if history and history[-1].get("role") == "user" and history[-1].get("content") == question:
+        history = history[:-1]
+    lines = [f"{msg.get('role', '').capitalize()}: {msg.get('content', '')}" for msg in history[-turns:]]
+    if not lines:
+        return question
+    return "CHAT HISTORY:\n" + "\n".join(lines) + f"\n\nUser question: {question}"
+
+# Token estimate for one request: input.text plus the template, billed on every call.
+# Items written before templates have no prompt_version, so the dashboard can
+# compare the two.
+def token_breakdown(input_text, template):
+    query_tokens = estimate_tokens(input_text)
+    return {
+        "input_tokens": query_tokens + template["tokens"],
+        "query_tokens": query_tokens,
+        "template_tokens": template["tokens"],
+        "prompt_version": f"{template['name']}/v{template['version']}",
+    }
@@ -0,0 +1,275 @@
+import argparse
+import json
+import os
+import re
+import time
+
+import aws_clients
+
+# Local query router
+#
+# classify() looks at a question with a few precompiled regexes (no model
+# call, a few microseconds) and returns its intent and whether it is a simple
+# lookup ("How can I contact the foundation?") or a complex question
+# (multi-part, compliance, procedures). route() maps that to a model tier:
+#
+#   simple  -> ROUTER_SIMPLE_MODEL_ID (falls back to BEDROCK_MODEL_ID), at most
+#              ROUTER_SIMPLE_RESULTS retrieved passages and
+#              ROUTER_SIMPLE_MAX_TOKENS output tokens
+#   complex -> BEDROCK_MODEL_ID with the knowledge base defaults
+#
+# Set QUERY_ROUTER=0 to send everything to the complex tier.
+#
+#   python query_router.py evaluate                  # over chatbot_history (+ archive)
+#   python query_router.py evaluate answers.jsonl    # over a batch.py output file
+#   python query_router.py evaluate complex.jsonl --routed routed.jsonl
+#                                                    # QUERY_ROUTER=0 vs =1 batch runs
+
+INTENT_PATTERNS = {
+    "contact": r"\b(contact|email|phone|call|reach|address|office hours|located|location)\b",
+    "research": r"\b(research|grant|grants|funding|proposal|sponsored|award)\b",
+    "employment": r"\b(employment|job|jobs|faculty|hiring|hr|benefits|payroll)\b",
+    "compliance": r"\b(compliance|audit|irb|iacuc|conflict of interest|export control|regulation)\b",
+    "forms": r"\b(form|forms|documents?|template|library)\b",
+    "board": r"\b(board|governance|directors|trustees)\b",
+}
+INTENT_RES = {intent: re.compile(pattern, re.I) for intent, pattern in INTENT_PATTERNS.items()}
+
+# Wording that usually means a procedure, a comparison or several questions at once
+COMPLEX_RE = re.compile(
+    r"\b(how (do|should|would) (i|we) (prepare|submit|handle|manage|comply|budget)|explain|difference|compare|"
+    r"versus|vs\.?|requirements?|steps|process|procedure|policy|policies|why|what if|subaward|indirect cost)\b",
+    re.I,
+)
+CONJUNCTION_RE = re.compile(r"\b(and also|as well as|also|additionally|plus)\b", re.I)
+SIMPLE_MAX_WORDS = 14
+
+# Fallback follow-up questions when the model does not return any, by intent
+FALLBACK_SUGGESTIONS = {
+    "research": [
+        "What is the Sponsored Programs Foundation?",
+        "How do I contact the research office?",
+        "What are the indirect cost rates?"
+    ],
+    "employment": [
+        "What are the faculty employment policies?",
+        "How do I find contact information for HR?",
+        "What benefits are available to employees?"
+    ],
+    "compliance": [
+        "What are the audit requirements?",
+        "How do I access financial reports?",
+        "What compliance policies should I know about?"
+    ],
+    "forms": [
+        "Where can I find the forms library?",
+        "What documents are required for proposals?",
+        "How do I access administrative policies?"
+    ],
+    "board": [
+        "Who are the board members?",
+        "What are the board meeting schedules?",
+        "How does the foundation governance work?"
+    ],
+    "general": [
+        "What services does the foundation provide?",
+        "How can I contact the foundation?",
+        "What are the foundation's policies?"
+    ],
+}
+
+# First matching intent wins, so order INTENT_PATTERNS from most to least specific
+def classify(question):
+    text = question or ""
+    intent = next((name for name, pattern in INTENT_RES.items() if pattern.search(text)), "general")
+    words = len(text.split())
+    questions = text.count("?")
+    complex_ = (
+        words > SIMPLE_MAX_WORDS
+        or questions > 1
+        or intent == "compliance"
+        or COMPLEX_RE.search(text) is not None
+        or CONJUNCTION_RE.search(text) is not None
+    )
+    return {"intent": intent, "complexity": "complex" if complex_ else "simple"}
+
+# Checked in FALLBACK_SUGGESTIONS order, so "contact the research office" still gets the research set
+def fallback_suggestions(question):
+    text = question or ""
+    intent = next((name for name in FALLBACK_SUGGESTIONS if name in INTENT_RES and INTENT_RES[name].search(text)), "general")
+    return FALLBACK_SUGGESTIONS[intent]
+
+# Model tier settings, read from the environment each call so .env changes apply
+def tiers():
+    default_model = os.getenv("BEDROCK_MODEL_ID")
+    return {
+        "simple": {
+            "model_id": os.getenv("ROUTER_SIMPLE_MODEL_ID") or default_model,
+            "number_of_results": int(os.getenv("ROUTER_SIMPLE_RESULTS", "3")),
+            "max_tokens": int(os.getenv("ROUTER_SIMPLE_MAX_TOKENS", "512")),
+        },
+        "complex": {
+            "model_id": default_model,
+            "number_of_results": None,
+            "max_tokens": None,
+        },
+    }
+
+# Simple lookups go to the cheaper tier with capped retrieval and output
+def route(question):
+    label = classify(question)
+    tier = label["complexity"] if os.getenv("QUERY_ROUTER", "1") != "0" else "complex"
+    return {"tier": tier, **label, **tiers()[tier]}
+
+# retrieveAndGenerateConfiguration for a routed request, optionally with a prompt template
+def knowledge_base_config(kb_id, routed, prompt_template=None, region="us-west-2"):
+    config = {
+        'knowledgeBaseId': kb_id,
+        'modelArn': f'arn:aws:bedrock:{region}::foundation-model/{routed["model_id"]}'
+    }
+    if routed.get("number_of_results"):
+        config['retrievalConfiguration'] = {
+            'vectorSearchConfiguration': {'numberOfResults': routed["number_of_results"]}
+        }
+    generation = {}
+    if routed.get("max_tokens"):
+        generation['inferenceConfig'] = {'textInferenceConfig': {'maxTokens': routed["max_tokens"]}}
+    if prompt_template:
+        generation['promptTemplate'] = {'textPromptTemplate': prompt_template}
+    if generation:
+        config['generationConfiguration'] = generation
+    return {'type': 'KNOWLEDGE_BASE', 'knowledgeBaseConfiguration': config}
+
+# --- Offline evaluation ---
+
+# USD per 1K input / output tokens for each tier; override with ROUTER_PRICE_<TIER>="in,out"
+DEFAULT_PRICES = {"simple": (0.00025, 0.00125), "complex": (0.003, 0.015)}
+
+def prices():
+    result = {}
+    for tier, default in DEFAULT_PRICES.items():
+        value = os.getenv(f"ROUTER_PRICE_{tier.upper()}")
+        result[tier] = tuple(float(v) for v in value.split(",")) if value else default
+    return result
+
+def _mean(values):
+    return sum(values) / len(values) if values else None
+
+def _median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2] if ordered else None
+
+# Rows logged before routing have no tier; they were all answered by the complex tier
+def _served_tier(row):
+    return row.get("model_tier") or "complex"
+
+def _cost(row, tier, price, output_cap=None):
+    query = row.get("query") or row.get("question") or ""
+    input_tokens = float(row.get("input_tokens") or (len(query) + 3) // 4)
+    output_tokens = float(row.get("output_tokens") or 0)
+    if output_cap is not None:
+        output_tokens = min(output_tokens, output_cap)
+    return (input_tokens * price[tier][0] + output_tokens * price[tier][1]) / 1000
+
+# Compare "everything on the complex tier" with routed traffic.
+#
+# rows need 'query' and may carry 'latency_ms', 'input_tokens', 'output_tokens'
+# and 'model_tier'. On their own they only give an estimated cost: rows the
+# complex tier answered are priced again with the simple tier (and its output
+# cap) where the router would send them; rows already answered by the simple
+# tier are left out, as their complex-tier cost is unknown. The latency saving
+# is then unknown too, because simple and complex rows are different questions.
+#
+# To measure it, replay the same questions on both tiers (two batch.py runs,
+# QUERY_ROUTER=0 and QUERY_ROUTER=1) and pass the second run as `routed`:
+# latency and cost are then compared per id on the queries routed as simple.
+def evaluate(rows, routed=None):
+    price = prices()
+    simple_cap = tiers()["simple"]["max_tokens"]
+    counts = {"simple": 0, "complex": 0}
+    intents = {}
+    classify_us = []
+    labels = []
+
+    for row in rows:
+        query = row.get("query") or row.get("question") or ""
+        start = time.perf_counter()
+        label = classify(query)
+        classify_us.append((time.perf_counter() - start) * 1e6)
+        counts[label["complexity"]] += 1
+        intents[label["intent"]] = intents.get(label["intent"], 0) + 1
+        labels.append((row, label["complexity"]))
+
+    total = sum(counts.values())
+    report = {
+        "queries": total,
+        "simple_share": counts["simple"] / total if total else 0.0,
+        "intents": intents,
+        "classify_us_mean": _mean(classify_us),
+    }
+
+    baseline_cost = routed_cost = 0.0
+    compared = 0
+    latency_saved = []
+    if routed is None:
+        for row, tier in labels:
+            if _served_tier(row) != "complex":
+                continue
+            compared += 1
+            baseline_cost += _cost(row, "complex", price)
+            routed_cost += _cost(row, tier, price, simple_cap if tier == "simple" else None)
+        report["cost_basis"] = "estimate from complex-tier rows"
+    else:
+        routed_by_id = {row["id"]: row for row in routed if row.get("id") is not None and not row.get("error")}
+        for row, tier in labels:
+            other = routed_by_id.get(row.get("id"))
+            if other is None or row.get("error") or _served_tier(row) != "complex":
+                continue
+            compared += 1
+            baseline_cost += _cost(row, "complex", price)
+            routed_cost += _cost(other, _served_tier(other), price)
+            if (tier == "simple" and _served_tier(other) == "simple"
+                    and row.get("latency_ms") is not None and other.get("latency_ms") is not None):
+                latency_saved.append(float(row["latency_ms"]) - float(other["latency_ms"]))
+        report["cost_basis"] = "measured on both tiers, per id"
+
+    report.update({
+        "cost_compared_queries": compared,
+        "baseline_cost_usd": round(baseline_cost, 4),
+        "routed_cost_usd": round(routed_cost, 4),
+        "cost_saved_usd": round(baseline_cost - routed_cost, 4),
+        "latency_compared_queries": len(latency_saved),
+        "latency_saved_ms_per_simple_query_mean": _mean(latency_saved),
+        "latency_saved_ms_per_simple_query_median": _median(latency_saved),
+    })
+    if not latency_saved:
+        report["latency_saved_note"] = (
+            "unknown: replay the questions with QUERY_ROUTER=0 and QUERY_ROUTER=1 "
+            "(two batch.py runs) and pass both files"
+        )
+    return report
+
+def _load_rows(path):
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    from history_archive import load_history, open_archive
+    dynamodb = aws_clients.resource('dynamodb')
+    return load_history(dynamodb.Table('chatbot_history'), open_archive())
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the query router over logged queries.")
+    parser.add_argument("command", choices=["evaluate"])
+    parser.add_argument("path", nargs="?", help="JSONL of logged queries (default: chatbot_history + archive)")
+    parser.add_argument("--routed", help="batch.py output for the same questions with QUERY_ROUTER=1 "
+                                         "(path is then the QUERY_ROUTER=0 run)")
+    args = parser.parse_args()
+    if args.routed and not args.path:
+        parser.error("--routed needs the QUERY_ROUTER=0 run as path")
+    routed = _load_rows(args.routed) if args.routed else None
+    print(json.dumps(evaluate(_load_rows(args.path), routed), indent=2))
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    main()
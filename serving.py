@@ -0,0 +1,127 @@
+import gzip
+import hashlib
+import os
+import zlib
+
+from flask import request, send_from_directory, abort
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is used when brotli is not installed
+    brotli = None
+
+# Response compression and static asset caching for backend.py
+#
+# init_app(app) adds:
+#   - gzip/brotli compression for HTML, JSON, CSS and JS responses
+#   - ETag + 304 Not Modified for regular (non-streamed) responses
+#   - /assets/<name>.<hash>.<ext>: static files under content-hashed names,
+#     served with a one-year immutable Cache-Control. Templates call
+#     asset_url('title.png') to get the current hashed URL.
+# sse_response() wraps an SSE generator and, when SSE_COMPRESSION=1, compresses
+# it with a sync flush after every event so each one still reaches the client
+# immediately.
+
+COMPRESSIBLE_TYPES = {"text/html", "application/json", "text/css", "application/javascript", "text/plain"}
+MIN_COMPRESS_SIZE = 500
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+_asset_hashes = {}
+
+# Best encoding the client accepts: br (if available), then gzip
+def choose_encoding(accept_encoding):
+    accepted = {part.split(";")[0].strip() for part in (accept_encoding or "").split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+# "title.png" -> "title.1a2b3c4d5e.png", cached until the file changes
+def hashed_name(static_folder, filename):
+    path = os.path.join(static_folder, filename)
+    mtime = os.path.getmtime(path)
+    cached = _asset_hashes.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:10]
+        root, ext = os.path.splitext(filename)
+        cached = (mtime, f"{root}.{digest}{ext}")
+        _asset_hashes[filename] = cached
+    return cached[1]
+
+def init_app(app):
+    @app.template_global()
+    def asset_url(filename):
+        return f"/assets/{hashed_name(app.static_folder, filename)}"
+
+    @app.route("/assets/<path:name>")
+    def assets(name):
+        root, ext = os.path.splitext(name)
+        filename, dot, _ = root.rpartition(".")
+        if not dot:
+            abort(404)
+        filename += ext
+        if not os.path.isfile(os.path.join(app.static_folder, filename)):
+            abort(404)
+        response = send_from_directory(app.static_folder, filename, conditional=True)
+        if name == hashed_name(app.static_folder, filename):
+            response.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+        else:
+            # Stale hash from an old page: serve the current file, but don't pin it
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    @app.after_request
+    def compress_and_tag(response):
+        # Streams (SSE) are handled by sse_response; files by send_from_directory
+        if response.is_streamed or response.direct_passthrough:
+            return response
+        if response.status_code != 200 or "Content-Encoding" in response.headers:
+            return response
+        if response.mimetype in COMPRESSIBLE_TYPES:
+            response.vary.add("Accept-Encoding")
+            encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+            data = response.get_data()
+            if encoding and len(data) >= MIN_COMPRESS_SIZE:
+                response.set_data(compress(data, encoding))
+                response.headers["Content-Encoding"] = encoding
+        # The ETag covers the encoded body, so gzip and br copies get different tags
+        response.add_etag()
+        return response.make_conditional(request)
+
+    return app
+
+# Wrap an SSE generator; compressed only if SSE_COMPRESSION=1 and the client accepts it
+def sse_response(generator, response_class, **kwargs):
+    headers = dict(kwargs.pop("headers", {}) or {})
+    encoding = None
+    if os.getenv("SSE_COMPRESSION") == "1":
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept-Encoding"
+        generator = _compress_stream(generator, encoding)
+    return response_class(generator, mimetype="text/event-stream", headers=headers, **kwargs)
+
+def _compress_stream(generator, encoding):
+    try:
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=5)
+            for event in generator:
+                yield compressor.process(event.encode("utf-8")) + compressor.flush()
+            yield compressor.finish()
+        else:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+            for event in generator:
+                # Z_SYNC_FLUSH emits everything so far without ending the stream
+                yield compressor.compress(event.encode("utf-8")) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield compressor.flush()
+    finally:
+        # Pass a client disconnect through to the wrapped generator
+        generator.close()
@@ -0,0 +1,161 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+# Bounded chat memory for Streamlit sessions (app.py)
+#
+# Each session keeps at most SESSION_MEMORY_BUDGET_KB of message text in
+# st.session_state. When a session goes over budget, compact() replaces the
+# oldest assistant answers (never the last KEEP_RECENT messages) with a short
+# summary plus a reference, and spills the full text, zlib-compressed, to a
+# local SQLite file (SESSION_SPILL_PATH). The full text is read back only
+# when the user asks to see that message again.
+#
+# SessionGauges keeps the per-session sizes for the whole process. With
+# LOG_MEMORY_GAUGES=1 the app logs them next to the process RSS once a minute,
+# for operators sizing a host; they are never shown in the chat UI.
+
+KEEP_RECENT = 6
+MIN_COMPACT_BYTES = 400
+SUMMARY_CHARS = 160
+MESSAGE_OVERHEAD = 200  # dict + str object overhead per message, roughly
+SPILL_MAX_AGE = 7 * 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+def memory_budget_bytes():
+    return int(os.getenv("SESSION_MEMORY_BUDGET_KB", "256")) * 1024
+
+class SpillStore:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS spill ("
+            "session_id TEXT, ref TEXT, data BLOB, created REAL, PRIMARY KEY (session_id, ref))"
+        )
+        # Sessions are gone after a server restart anyway; don't keep their text forever
+        self.db.execute("DELETE FROM spill WHERE created < ?", (time.time() - SPILL_MAX_AGE,))
+        self.db.commit()
+
+    def put(self, session_id, ref, text):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO spill VALUES (?, ?, ?, ?)",
+                (session_id, ref, zlib.compress(text.encode("utf-8"), 6), time.time())
+            )
+            self.db.commit()
+
+    def get(self, session_id, ref):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT data FROM spill WHERE session_id = ? AND ref = ?", (session_id, ref)
+            ).fetchone()
+        return zlib.decompress(row[0]).decode("utf-8") if row else None
+
+    def drop_session(self, session_id):
+        with self.lock:
+            self.db.execute("DELETE FROM spill WHERE session_id = ?", (session_id,))
+            self.db.commit()
+
+def message_size(message):
+    return len(message.get("content", "").encode("utf-8")) + MESSAGE_OVERHEAD
+
+def session_size(messages):
+    return sum(message_size(m) for m in messages)
+
+# First sentence (or line) of a message, cut to SUMMARY_CHARS
+def summarize(text):
+    # Drop the sources block app.py appends to answers
+    text = text.split("**📚 Sources:**")[0].strip()
+    first = re.split(r"(?<=[.!?])\s|\n", text, maxsplit=1)[0]
+    if len(first) > SUMMARY_CHARS:
+        first = first[:SUMMARY_CHARS].rstrip()
+    return first + " …"
+
+# Compact the oldest assistant messages until the session fits the budget; returns bytes freed
+def compact(messages, session_id, store, budget=None, keep_recent=KEEP_RECENT):
+    budget = memory_budget_bytes() if budget is None else budget
+    size = session_size(messages)
+    freed = 0
+    for index, message in enumerate(messages[:max(len(messages) - keep_recent, 0)]):
+        if size <= budget:
+            break
+        # User messages stay intact: app.py compares them to decide what still needs an answer
+        if message["role"] != "assistant" or message.get("ref") or message_size(message) < MIN_COMPACT_BYTES:
+            continue
+        ref = f"m{index}"
+        store.put(session_id, ref, message["content"])
+        before = message_size(message)
+        message["content"] = summarize(message["content"])
+        message["ref"] = ref
+        freed += before - message_size(message)
+        size -= before - message_size(message)
+    return freed
+
+# Current resident set size of this process, in bytes
+def process_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        # Peak rather than current RSS, but available everywhere (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+# Message memory of every live session in this process
+class SessionGauges:
+    IDLE_SECONDS = 3600
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sizes = {}
+        self.seen = {}
+        self.pruned_at = time.time()
+        self.logged_at = 0
+
+    # Streamlit doesn't tell us when a session ends, so forget idle ones (caller holds the lock)
+    def _prune(self, now):
+        for session_id in [s for s, t in self.seen.items() if now - t > self.IDLE_SECONDS]:
+            self.sizes.pop(session_id, None)
+            self.seen.pop(session_id, None)
+        self.pruned_at = now
+
+    def update(self, session_id, size):
+        now = time.time()
+        with self.lock:
+            self.sizes[session_id] = size
+            self.seen[session_id] = now
+            # Pruned here too, so the gauges stay bounded when nobody reads them
+            if now - self.pruned_at > 60:
+                self._prune(now)
+
+    def snapshot(self):
+        with self.lock:
+            self._prune(time.time())
+            sizes = list(self.sizes.values())
+        return {
+            "sessions": len(sizes),
+            "session_bytes_total": sum(sizes),
+            "session_bytes_max": max(sizes, default=0),
+            "process_rss_bytes": process_rss_bytes(),
+        }
+
+    # Log snapshot() at most once per `interval` seconds
+    def log(self, interval=60):
+        now = time.time()
+        with self.lock:
+            if now - self.logged_at < interval:
+                return
+            self.logged_at = now
+        gauges = self.snapshot()
+        logger.info(
+            "%d sessions, %.1f KB session memory (largest %.1f KB), process RSS %.0f MB",
+            gauges["sessions"], gauges["session_bytes_total"] / 1024,
+            gauges["session_bytes_max"] / 1024, gauges["process_rss_bytes"] / 2**20
+        )
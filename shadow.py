@@ -0,0 +1,189 @@
+import argparse
+import json
+import logging
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import aws_clients
+from history_store import TTL_ATTRIBUTE, history_ttl_days
+from prompt_templates import load_template
+
+# Shadow traffic: compare a candidate configuration against live answers
+#
+# With SHADOW_SAMPLE_RATE > 0, backend.chat_stream mirrors that fraction of
+# questions to a candidate configuration on a background thread while the
+# live answer streams to the user. The candidate's answer is thrown away;
+# only the comparison is kept, one item per mirrored question in the
+# SHADOW_TABLE_NAME table (key session_id + timestamp, like chatbot_history):
+# latency, time to first token, token estimates, whether the <SUGGESTIONS>
+# block parsed, and how much the cited sources overlap.
+#
+# The candidate overrides any of (unset means "same as live"):
+#   SHADOW_NAME                label in the dashboard (default "candidate")
+#   SHADOW_MODEL_ID            model for every question, routing ignored
+#   SHADOW_KNOWLEDGE_BASE_ID
+#   SHADOW_PROMPT_VERSION      version of prompts/kb_answer
+#   SHADOW_NUMBER_OF_RESULTS, SHADOW_MAX_TOKENS
+#
+# At most SHADOW_MAX_PENDING candidate calls run at once; questions beyond
+# that are not mirrored, so a slow candidate never backs up live traffic.
+#
+#   python shadow.py report    # summary per candidate from the shadow table
+
+logger = logging.getLogger(__name__)
+
+def sample_rate():
+    return float(os.getenv("SHADOW_SAMPLE_RATE", "0"))
+
+def shadow_table_name():
+    return os.getenv("SHADOW_TABLE_NAME", "chatbot_shadow")
+
+def _int_env(name):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+def candidate_config():
+    version = os.getenv("SHADOW_PROMPT_VERSION")
+    return {
+        "name": os.getenv("SHADOW_NAME", "candidate"),
+        "model_id": os.getenv("SHADOW_MODEL_ID"),
+        "kb_id": os.getenv("SHADOW_KNOWLEDGE_BASE_ID"),
+        "template": load_template("kb_answer", version) if version else None,
+        "number_of_results": _int_env("SHADOW_NUMBER_OF_RESULTS"),
+        "max_tokens": _int_env("SHADOW_MAX_TOKENS"),
+    }
+
+# Routed settings (query_router.route) with the candidate's overrides applied
+def apply_candidate(routed, candidate):
+    routed = dict(routed)
+    for key in ("model_id", "number_of_results", "max_tokens"):
+        if candidate.get(key):
+            routed[key] = candidate[key]
+    if candidate.get("model_id"):
+        routed["tier"] = "shadow"
+    return routed
+
+# Jaccard overlap of the two source lists (1.0 when neither cites anything)
+def citation_overlap(a, b):
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+def _number(value):
+    return None if value is None else Decimal(str(round(value, 1)))
+
+# One shadow table item from the live and candidate results (backend.stream_knowledge_base)
+def build_comparison(session_id, query, candidate_name, live, shadow=None, error=None, timestamp=None):
+    timestamp = timestamp or datetime.now().isoformat()
+    item = {
+        'session_id': session_id,
+        'timestamp': timestamp,
+        'query': query,
+        'candidate': candidate_name,
+        'live_prompt_version': live.get("prompt_version"),
+        'live_model_tier': live.get("model_tier"),
+        TTL_ATTRIBUTE: int((datetime.fromisoformat(timestamp) + timedelta(days=history_ttl_days())).timestamp()),
+    }
+    for side, result in (("live", live), ("candidate", shadow)):
+        if result is None:
+            continue
+        for key in ("latency_ms", "first_token_ms", "input_tokens", "output_tokens"):
+            item[f"{side}_{key}"] = _number(result.get(key))
+        item[f"{side}_suggestions_parsed"] = bool(result.get("suggestions_parsed"))
+        item[f"{side}_sources"] = len(result.get("sources", []))
+    if shadow is not None:
+        item['candidate_prompt_version'] = shadow.get("prompt_version")
+        item['citation_overlap'] = _number(citation_overlap(live.get("sources", []), shadow.get("sources", [])) * 100)
+    if error is not None:
+        item['candidate_error'] = str(error)[:500]
+    return {k: v for k, v in item.items() if v is not None}
+
+class ShadowRunner:
+    def __init__(self, save, max_pending=None):
+        self.save = save
+        self.max_pending = max_pending or int(os.getenv("SHADOW_MAX_PENDING", "4"))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_pending, thread_name_prefix="shadow")
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def sampled(self):
+        return random.random() < sample_rate()
+
+    # Start run() in the background if this request is sampled and there is room; returns a future or None
+    def mirror(self, run):
+        if not self.sampled():
+            return None
+        with self.lock:
+            if self.pending >= self.max_pending:
+                return None
+            self.pending += 1
+        future = self.executor.submit(run)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    # Once the candidate finishes, store its comparison with the live result
+    def record(self, future, session_id, query, candidate_name, live):
+        def done(future):
+            error = future.exception()
+            try:
+                self.save(build_comparison(session_id, query, candidate_name, live,
+                                           None if error else future.result(), error))
+            except Exception:
+                logger.exception("Saving shadow comparison failed")
+        future.add_done_callback(done)
+
+# --- Reporting (dashboard.py and the CLI) ---
+
+def _mean(values):
+    return sum(values) / len(values) if values else None
+
+def _p95(values):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else None
+
+def _values(rows, key):
+    return [float(row[key]) for row in rows if row.get(key) is not None]
+
+def _rate(rows, key):
+    return _mean([1.0 if row.get(key) else 0.0 for row in rows])
+
+# One summary row per candidate, live and candidate side by side
+def summarize(items):
+    by_candidate = {}
+    for item in items:
+        by_candidate.setdefault(item.get("candidate", "candidate"), []).append(item)
+    summary = []
+    for name, rows in sorted(by_candidate.items()):
+        ok = [row for row in rows if "candidate_error" not in row]
+        entry = {"candidate": name, "mirrored": len(rows), "candidate_errors": len(rows) - len(ok)}
+        for side in ("live", "candidate"):
+            entry[f"{side}_latency_ms_mean"] = _mean(_values(ok, f"{side}_latency_ms"))
+            entry[f"{side}_latency_ms_p95"] = _p95(_values(ok, f"{side}_latency_ms"))
+            entry[f"{side}_first_token_ms_mean"] = _mean(_values(ok, f"{side}_first_token_ms"))
+            entry[f"{side}_input_tokens_mean"] = _mean(_values(ok, f"{side}_input_tokens"))
+            entry[f"{side}_output_tokens_mean"] = _mean(_values(ok, f"{side}_output_tokens"))
+            entry[f"{side}_suggestions_parsed"] = _rate(ok, f"{side}_suggestions_parsed")
+        entry["citation_overlap_pct_mean"] = _mean(_values(ok, "citation_overlap"))
+        summary.append({k: round(v, 3) if isinstance(v, float) else v for k, v in entry.items()})
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize shadow traffic comparisons.")
+    parser.add_argument("command", choices=["report"])
+    parser.parse_args()
+
+    from history_archive import scan_hot
+    dynamodb = aws_clients.resource('dynamodb')
+    print(json.dumps(summarize(scan_hot(dynamodb.Table(shadow_table_name()))), indent=2))
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    main()
@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Warm-up and cold start measurement
+#
+# Entry points keep imports light and create AWS clients on first use. A
+# Warmup runs the expensive first-use steps (clients, connections, template
+# caches) on a background thread once the server starts serving (backend.py
+# starts it on the first request, not on import), and reports progress
+# so a load balancer or autoscaler can wait for readiness (backend.py serves
+# it at /ready; 503 until every step has succeeded). Failed steps are retried
+# every WARMUP_RETRY_SECONDS; with WARMUP_STRICT=0 a failed step is only
+# reported and does not hold back readiness.
+#
+#   python startup.py bench                 # all entry points, 3 cold runs each
+#   python startup.py bench backend --runs 5
+#
+# Each run is a fresh interpreter. For backend.py it times the import, the
+# first GET / and the time until /ready; for the Streamlit scripts it times
+# the first script run and a rerun (streamlit.testing AppTest).
+
+class Warmup:
+    def __init__(self):
+        self.steps = []
+        self.status_by_step = {}
+        self.lock = threading.Lock()
+        self.started = None
+        self.finished = None
+        self.thread = None
+
+    def add(self, name, fn):
+        self.steps.append((name, fn))
+        self.status_by_step[name] = {"done": False}
+
+    def run(self):
+        self.started = time.perf_counter()
+        retry_seconds = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+        remaining = list(self.steps)
+        attempt = 0
+        while remaining:
+            attempt += 1
+            failed = []
+            for name, fn in remaining:
+                start = time.perf_counter()
+                status = {"done": True, "attempts": attempt}
+                try:
+                    fn()
+                except Exception as e:
+                    status["error"] = f"{type(e).__name__}: {e}"
+                    failed.append((name, fn))
+                status["ms"] = round((time.perf_counter() - start) * 1000, 1)
+                with self.lock:
+                    self.status_by_step[name] = status
+            remaining = failed
+            if remaining:
+                time.sleep(retry_seconds)
+        self.finished = time.perf_counter()
+
+    # Only the first call starts the thread
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True, name="warmup")
+                self.thread.start()
+        return self
+
+    def status(self):
+        with self.lock:
+            steps = {name: dict(status) for name, status in self.status_by_step.items()}
+        strict = os.getenv("WARMUP_STRICT", "1") != "0"
+        ready = all(s["done"] and not (strict and "error" in s) for s in steps.values())
+        end = self.finished or time.perf_counter()
+        return {
+            "ready": ready,
+            "elapsed_ms": round((end - self.started) * 1000, 1) if self.started else 0.0,
+            "steps": steps,
+        }
+
+def warmup_enabled():
+    return os.getenv("WARMUP", "1") != "0"
+
+# --- Benchmark ---
+
+BACKEND_BENCH = """
+import json, time
+start = time.perf_counter()
+import backend
+imported = time.perf_counter()
+client = backend.app.test_client()
+client.get("/")
+first_request = time.perf_counter()
+while client.get("/ready").status_code != 200 and time.perf_counter() - start < {timeout}:
+    time.sleep(0.01)
+ready = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "first_request_ms": (first_request - imported) * 1000,
+    "ready_ms": (ready - start) * 1000,
+    "warmup": client.get("/ready").get_json(),
+}}))
+"""
+
+STREAMLIT_BENCH = """
+import json, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+app = AppTest.from_file({path!r}, default_timeout={timeout})
+app.run()
+first_run = time.perf_counter()
+app.run()
+rerun = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "first_run_ms": (first_run - imported) * 1000,
+    "rerun_ms": (rerun - first_run) * 1000,
+    "exceptions": [e.value for e in app.exception],
+}}))
+"""
+
+ENTRY_POINTS = {
+    "backend": BACKEND_BENCH,
+    "app": STREAMLIT_BENCH,
+    "dashboard": STREAMLIT_BENCH,
+}
+
+def bench_once(entry, timeout=60):
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = ENTRY_POINTS[entry].format(path=os.path.join(here, f"{entry}.py"), timeout=timeout)
+    result = subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True,
+                            timeout=timeout * 3)
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def bench(entries, runs):
+    report = {}
+    for entry in entries:
+        samples = [bench_once(entry) for _ in range(runs)]
+        ok = [s for s in samples if "error" not in s]
+        summary = {"runs": runs, "errors": [s["error"] for s in samples if "error" in s]}
+        for key in ("import_ms", "first_request_ms", "ready_ms", "first_run_ms", "rerun_ms"):
+            values = sorted(s[key] for s in ok if key in s)
+            if values:
+                summary[f"{key}_median"] = round(values[len(values) // 2], 1)
+        if ok:
+            summary["last"] = ok[-1].get("warmup") or ok[-1].get("exceptions")
+        report[entry] = summary
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold start of the entry points.")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("entries", nargs="*", help=f"any of {', '.join(ENTRY_POINTS)} (default: all)")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    unknown = set(args.entries) - set(ENTRY_POINTS)
+    if unknown:
+        parser.error(f"unknown entry point: {', '.join(sorted(unknown))}")
+    print(json.dumps(bench(args.entries or list(ENTRY_POINTS), args.runs), indent=2))
+
+if __name__ == "__main__":
+    main()
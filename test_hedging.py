@@ -0,0 +1,59 @@
+import time
+
+from hedging import LatencyTracker, Replica, StubError, hedged_call, hedged_stream
+
+# Stub replica that records when it was started and answers after delay seconds
+def timed_replica(name, delay, launches, start, throttled=False):
+    def open_stream(replica):
+        launches[name] = time.perf_counter() - start
+        if throttled:
+            raise StubError("ThrottlingException")
+        time.sleep(delay)
+        return [{"output": {"text": name}}]
+    return Replica(name, open_stream, "stub")
+
+def first_text(replicas, tracker, hedge):
+    stream = hedged_stream(replicas, lambda r: r.client(r), tracker, hedge)
+    try:
+        return next(iter(stream))["output"]["text"]
+    finally:
+        stream.close()
+
+def test_hedges_are_spaced_one_deadline_apart(monkeypatch):
+    monkeypatch.setenv("HEDGE_DEADLINE_MS", "100")
+    launches, start = {}, time.perf_counter()
+    replicas = [timed_replica(name, 1.0, launches, start) for name in "abcd"]
+    replicas[2] = timed_replica("c", 0.05, launches, start)
+
+    assert first_text(replicas, LatencyTracker(), hedge=True) == "c"
+    # c answers ~0.25 s in, before d's hedge is due at ~0.3 s
+    assert set(launches) == {"a", "b", "c"}
+    assert 0.09 <= launches["b"] < launches["c"] - 0.09
+
+def test_no_hedge_without_hedging(monkeypatch):
+    monkeypatch.setenv("HEDGE_DEADLINE_MS", "20")
+    launches, start = {}, time.perf_counter()
+    replicas = [timed_replica(name, 0.1, launches, start) for name in "abc"]
+
+    assert first_text(replicas, LatencyTracker(), hedge=False) == "a"
+    assert set(launches) == {"a"}
+
+def test_throttling_fails_over_in_order():
+    launches, start = {}, time.perf_counter()
+    replicas = [
+        timed_replica("a", 0, launches, start, throttled=True),
+        timed_replica("b", 0, launches, start, throttled=True),
+        timed_replica("c", 0, launches, start),
+    ]
+
+    assert first_text(replicas, LatencyTracker(), hedge=False) == "c"
+
+def test_hedged_call_only_fails_over(monkeypatch):
+    monkeypatch.setenv("HEDGING", "1")
+    monkeypatch.setenv("HEDGE_DEADLINE_MS", "10")
+    launches, start = {}, time.perf_counter()
+    replicas = [timed_replica(name, 0.1, launches, start) for name in "abc"]
+
+    result = hedged_call(replicas, lambda r: r.client(r)[0])
+    assert result["output"]["text"] == "a"
+    assert set(launches) == {"a"}